@@ -290,24 +290,29 @@ class AuthUI:
     def _confirm_registration(self, user_data: Dict[str, Any]) -> bool:
         """Подтверждение данных регистрации"""
         self.clear_screen()
-        print("ПОДТВЕРЖДЕНИЕ РЕГИСТРАЦИИ")
-        print("=" * 50)
-        print(f"ФИО: {user_data['full_name']}")
-        print(f"Логин: {user_data['login']}")
-        print(f"Email: {user_data['email']}")
-        print(f"Телефон: +7{user_data['phone']}")
-        print(f"Паспорт: {user_data['passport_series']} {user_data['passport_number']}")
-        print(f"Дата рождения: {user_data['birth_date']}")
-        
+
         # Вычисляем возраст для подтверждения
         birth_date_obj = datetime.strptime(user_data['birth_date'], '%Y-%m-%d').date()
         today = date.today()
         age = today.year - birth_date_obj.year
         if today.month < birth_date_obj.month or (today.month == birth_date_obj.month and today.day < birth_date_obj.day):
             age -= 1
-        print(f"Возраст: {age} лет")
-        print("=" * 50)
-        
+
+        # Весь блок подтверждения форматируется и выводится одним вызовом
+        separator = "=" * 50
+        print(
+            f"ПОДТВЕРЖДЕНИЕ РЕГИСТРАЦИИ\n"
+            f"{separator}\n"
+            f"ФИО: {user_data['full_name']}\n"
+            f"Логин: {user_data['login']}\n"
+            f"Email: {user_data['email']}\n"
+            f"Телефон: +7{user_data['phone']}\n"
+            f"Паспорт: {user_data['passport_series']} {user_data['passport_number']}\n"
+            f"Дата рождения: {user_data['birth_date']}\n"
+            f"Возраст: {age} лет\n"
+            f"{separator}"
+        )
+
         confirm = input("\nПодтвердить регистрацию? (да/нет): ").strip().lower()
         return confirm in ['да', 'д', 'yes', 'y']
     
@@ -385,7 +390,8 @@ class AuthUI:
                     ORDER BY created_at DESC 
                     LIMIT 10
                 ''')
-                return [dict(user) for user in users]
+                # asyncpg.Record поддерживает доступ по имени поля, dict не нужен
+                return list(users)
         except Exception as e:
             print(f"Ошибка получения пользователей: {e}")
             return []
@@ -1,41 +1,152 @@
 import asyncpg
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Set
 import hashlib
+import hmac
 import secrets
-from datetime import datetime, date
+from datetime import date
 import re
 
 logger = logging.getLogger(__name__)
 
+# Параметры PBKDF2. hashlib.pbkdf2_hmac реализован в OpenSSL (PKCS5_PBKDF2_HMAC),
+# поэтому все итерации выполняются в C. Новые хеши считаются на SHA-512, который
+# работает 64-битными словами; алгоритм каждого хеша хранится в users.hash_algo,
+# поэтому ранее сохранённые SHA-256 хеши продолжают проверяться.
+PBKDF2_ALGORITHM = 'sha512'
+PBKDF2_LEGACY_ALGORITHM = 'sha256'
+PBKDF2_ITERATIONS = 100_000
+PBKDF2_KEY_LENGTH = 32
+
+# pbkdf2_hmac отпускает GIL, поэтому хеширование в пуле потоков не блокирует
+# event loop и параллелится по ядрам
+_HASH_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix='pbkdf2')
+
 class DatabaseManager:
     """Менеджер базы данных PostgreSQL для аутентификации"""
     
+    # Шаблоны валидации регистрационных данных
+    _RE_LOGIN = re.compile(r'^[a-zA-Z0-9_]+$')
+    _RE_EMAIL = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+    _RE_NONDIGIT = re.compile(r'\D')
+    
+    # Размер кэша подготовленных выражений asyncpg на одно соединение
+    STATEMENT_CACHE_SIZE = 256
+    
+    # Размеры пула и предельное время выполнения запроса (сек)
+    POOL_MIN_SIZE = 4
+    POOL_MAX_SIZE = max(POOL_MIN_SIZE, (os.cpu_count() or 1) * 2)
+    COMMAND_TIMEOUT = 10
+    
+    # Параметры сессии передаются при подключении и переживают RESET ALL,
+    # который пул выполняет при возврате соединения
+    # Часовой пояс сессии не переопределяется: created_at и last_login имеют тип
+    # TIMESTAMP без пояса и заполняются NOW() в поясе сервера
+    SERVER_SETTINGS = {
+        # JIT для коротких OLTP-запросов дороже самого запроса
+        'jit': 'off'
+    }
+    
+    # Период (сек) пакетной записи времени последнего входа
+    LAST_LOGIN_FLUSH_INTERVAL = 1.0
+    
+    # Тексты запросов горячего пути. asyncpg кэширует подготовленные выражения
+    # по тексту запроса, поэтому они вынесены в константы и не меняются между вызовами
+    _USER_LOOKUP_COLUMNS = frozenset({'login', 'email', 'phone'})
+    _SQL_USER_EXISTS = 'SELECT EXISTS(SELECT 1 FROM users WHERE {column} = $1)'
+    _SQL_CHECK_TAKEN = '''
+        SELECT bool_or(login = $1) AS login_taken,
+               bool_or(email = $2) AS email_taken,
+               bool_or(phone = $3) AS phone_taken
+        FROM users
+        WHERE login = $1 OR email = $2 OR phone = $3
+    '''
+    _SQL_INSERT_USER = '''
+        INSERT INTO users 
+        (login, password_hash, hash_algo, salt, email, full_name, passport_series, 
+         passport_number, birth_date, age, phone)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+    '''
+    # Пакетная регистрация одним запросом по массивам колонок (порядок совпадает
+    # с кортежами записей). Бинарный COPY не подходит: у asyncpg нет кодека для
+    # CITEXT, а text[] приводится к нему при вставке
+    _SQL_INSERT_USERS_BULK = '''
+        INSERT INTO users 
+        (login, password_hash, hash_algo, salt, email, full_name, passport_series, 
+         passport_number, birth_date, age, phone)
+        SELECT * FROM unnest(
+            $1::text[], $2::bytea[], $3::text[], $4::bytea[], $5::text[], $6::text[],
+            $7::text[], $8::text[], $9::date[], $10::int[], $11::text[]
+        )
+        ON CONFLICT DO NOTHING
+        RETURNING login
+    '''
+    _SQL_AUTHENTICATE = '''
+        SELECT id, login, password_hash, hash_algo, salt, email, full_name, phone,
+               passport_series, passport_number, birth_date, age,
+               is_active
+        FROM users 
+        WHERE (login = $1 OR email = $1 OR phone = $1) AND is_active = TRUE
+    '''
+    _SQL_UPDATE_LAST_LOGIN = 'UPDATE users SET last_login = NOW() WHERE id = ANY($1::int[])'
+    
     def __init__(self, connection_string: str):
         self.connection_string = connection_string
         self.pool: Optional[asyncpg.Pool] = None
+        # id пользователей, чье время входа ожидает записи в БД
+        self._pending_last_login: Set[int] = set()
+        self._last_login_task: Optional[asyncio.Task] = None
     
     async def connect(self):
         """Подключение к базе данных и создание таблиц"""
         try:
-            self.pool = await asyncpg.create_pool(self.connection_string)
+            # Схема создается до пула: init каждого соединения готовит запросы к users
             await self._create_tables()
+            self.pool = await asyncpg.create_pool(
+                self.connection_string,
+                min_size=self.POOL_MIN_SIZE,
+                max_size=self.POOL_MAX_SIZE,
+                command_timeout=self.COMMAND_TIMEOUT,
+                server_settings=self.SERVER_SETTINGS,
+                statement_cache_size=self.STATEMENT_CACHE_SIZE,
+                init=self._init_connection
+            )
+            self._last_login_task = asyncio.create_task(self._last_login_writer())
             logger.info("Подключение к PostgreSQL установлено")
         except Exception as e:
             logger.error(f"Ошибка подключения к PostgreSQL: {e}")
             raise
     
+    async def _init_connection(self, conn: asyncpg.Connection):
+        """Подготовка запросов на новом соединении пула
+        
+        Объект PreparedStatement недействителен после возврата соединения
+        в пул, поэтому выражение прогревается в кэше соединения: первый вызов
+        готовит его, последующие fetchrow с тем же текстом берут его из кэша.
+        Требует сессионного пулинга: в транзакционном режиме pgbouncer
+        подготовленные выражения не переживают смену серверного соединения.
+        """
+        await conn.fetchrow(self._SQL_AUTHENTICATE, '')
+    
     async def _create_tables(self):
         """Создание необходимых таблиц"""
-        async with self.pool.acquire() as conn:
+        conn = await asyncpg.connect(self.connection_string)
+        try:
+            # Регистронезависимый текст для логина и email
+            await conn.execute('CREATE EXTENSION IF NOT EXISTS citext')
+            
             # Таблица пользователей
             await conn.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     id SERIAL PRIMARY KEY,
-                    login VARCHAR(50) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    salt VARCHAR(32) NOT NULL,
-                    email VARCHAR(100) UNIQUE NOT NULL,
+                    login CITEXT UNIQUE NOT NULL,
+                    password_hash BYTEA NOT NULL,
+                    hash_algo VARCHAR(16) NOT NULL DEFAULT 'sha256',
+                    salt BYTEA NOT NULL,
+                    email CITEXT UNIQUE NOT NULL,
                     full_name VARCHAR(200) NOT NULL,
                     passport_series VARCHAR(4) NOT NULL,
                     passport_number VARCHAR(6) NOT NULL,
@@ -48,37 +159,88 @@ class DatabaseManager:
                 )
             ''')
             
-            # Индексы для быстрого поиска
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_login ON users(login)')
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
-            await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone)')
+            await self._migrate_tables(conn)
+            
+            # Частичные индексы только по активным пользователям для входа;
+            # проверки уникальности обслуживают индексы UNIQUE-ограничений
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_login_active ON users(login) WHERE is_active')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_email_active ON users(email) WHERE is_active')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_phone_active ON users(phone) WHERE is_active')
+        finally:
+            await conn.close()
+    
+    @staticmethod
+    async def _column_type(conn: asyncpg.Connection, column: str) -> Optional[str]:
+        """Имя типа колонки таблицы users"""
+        return await conn.fetchval('''
+            SELECT udt_name FROM information_schema.columns
+            WHERE table_name = 'users' AND column_name = $1
+        ''', column)
+    
+    async def _migrate_tables(self, conn: asyncpg.Connection):
+        """Приведение существующей таблицы users к актуальной схеме"""
+        # Хеш пароля хранится в сырых байтах; старые таблицы содержат hex-строку
+        if await self._column_type(conn, 'password_hash') != 'bytea':
+            await conn.execute(
+                "ALTER TABLE users ALTER COLUMN password_hash TYPE BYTEA USING decode(password_hash, 'hex')"
+            )
+            logger.info("Колонка users.password_hash переведена в BYTEA")
+        
+        # Соль хранится в сырых байтах. Старые соли были hex-строками, и в PBKDF2
+        # передавались их UTF-8 байты: convert_to сохраняет ровно эти байты
+        if await self._column_type(conn, 'salt') != 'bytea':
+            await conn.execute(
+                "ALTER TABLE users ALTER COLUMN salt TYPE BYTEA USING convert_to(salt, 'UTF8')"
+            )
+            logger.info("Колонка users.salt переведена в BYTEA")
+        
+        # Хеши, созданные до появления колонки, посчитаны на SHA-256
+        await conn.execute(
+            f"ALTER TABLE users ADD COLUMN IF NOT EXISTS hash_algo VARCHAR(16) NOT NULL DEFAULT '{PBKDF2_LEGACY_ALGORITHM}'"
+        )
+        
+        # Логин и email сравниваются без учета регистра без обертки lower()
+        for column in ('login', 'email'):
+            if await self._column_type(conn, column) != 'citext':
+                await conn.execute(f'ALTER TABLE users ALTER COLUMN {column} TYPE CITEXT')
+                logger.info(f"Колонка users.{column} переведена в CITEXT")
+        
+        # Полные индексы дублировали индексы UNIQUE-ограничений
+        await conn.execute('DROP INDEX IF EXISTS idx_users_login')
+        await conn.execute('DROP INDEX IF EXISTS idx_users_email')
+        await conn.execute('DROP INDEX IF EXISTS idx_users_phone')
     
     @staticmethod
-    def _hash_password(password: str, salt: str) -> str:
+    def _hash_password(password: str, salt: bytes, algorithm: str = PBKDF2_ALGORITHM) -> bytes:
         """Хеширование пароля с солью"""
         return hashlib.pbkdf2_hmac(
-            'sha256',
+            algorithm,
             password.encode('utf-8'),
-            salt.encode('utf-8'),
-            100000
-        ).hex()
+            salt,
+            PBKDF2_ITERATIONS,
+            dklen=PBKDF2_KEY_LENGTH
+        )
+    
+    async def _hash_password_async(self, password: str, salt: bytes,
+                                   algorithm: str = PBKDF2_ALGORITHM) -> bytes:
+        """Хеширование пароля в отдельном потоке, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _HASH_EXECUTOR, self._hash_password, password, salt, algorithm
+        )
     
     @staticmethod
-    def _generate_salt() -> str:
+    def _generate_salt() -> bytes:
         """Генерация соли для пароля"""
-        return secrets.token_hex(16)
+        return secrets.token_bytes(16)
     
     @staticmethod
-    def _calculate_age(birth_date: date) -> int:
+    def _calculate_age(birth_date: date, today: Optional[date] = None) -> int:
         """Вычисление возраста по дате рождения"""
-        today = date.today()
-        age = today.year - birth_date.year
-        
-        # Проверяем, был ли уже день рождения в этом году
-        if today.month < birth_date.month or (today.month == birth_date.month and today.day < birth_date.day):
-            age -= 1
-            
-        return age
+        if today is None:
+            today = date.today()
+        # Сравнение кортежей дает 1, если день рождения в этом году еще не наступил
+        return (today.year - birth_date.year) - ((today.month, today.day) < (birth_date.month, birth_date.day))
     
     async def register_user(self, 
                           login: str,
@@ -99,31 +261,31 @@ class DatabaseManager:
             if not validation_result["success"]:
                 return validation_result
             
-            # Проверяем уникальность логина, email и телефона
-            if await self._check_user_exists(login=login):
-                return {"success": False, "error": "Пользователь с таким логином уже существует"}
-            
-            if await self._check_user_exists(email=email):
-                return {"success": False, "error": "Пользователь с таким email уже существует"}
-            
-            if await self._check_user_exists(phone=phone):
-                return {"success": False, "error": "Пользователь с таким номером телефона уже существует"}
-            
-            # Вычисляем возраст
-            age = self._calculate_age(birth_date)
-            
-            # Хешируем пароль
-            salt = self._generate_salt()
-            password_hash = self._hash_password(password, salt)
-            
             async with self.pool.acquire() as conn:
-                await conn.execute('''
-                    INSERT INTO users 
-                    (login, password_hash, salt, email, full_name, passport_series, 
-                     passport_number, birth_date, age, phone)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-                ''', login, password_hash, salt, email, full_name, 
-                   passport_series, passport_number, birth_date, age, phone)
+                # Проверяем уникальность логина, email и телефона одним запросом
+                taken = await conn.fetchrow(self._SQL_CHECK_TAKEN, login, email, phone)
+                
+                if taken['login_taken']:
+                    return {"success": False, "error": "Пользователь с таким логином уже существует"}
+                
+                if taken['email_taken']:
+                    return {"success": False, "error": "Пользователь с таким email уже существует"}
+                
+                if taken['phone_taken']:
+                    return {"success": False, "error": "Пользователь с таким номером телефона уже существует"}
+                
+                # Вычисляем возраст
+                age = self._calculate_age(birth_date)
+                
+                # Хешируем пароль
+                salt = self._generate_salt()
+                password_hash = await self._hash_password_async(password, salt)
+                
+                await conn.execute(
+                    self._SQL_INSERT_USER,
+                    login, password_hash, PBKDF2_ALGORITHM, salt, email, full_name,
+                    passport_series, passport_number, birth_date, age, phone
+                )
                 
             logger.info(f"Пользователь {login} успешно зарегистрирован")
             return {"success": True, "message": "Регистрация успешно завершена"}
@@ -135,50 +297,126 @@ class DatabaseManager:
             logger.error(f"Ошибка регистрации пользователя: {e}")
             return {"success": False, "error": f"Ошибка регистрации: {str(e)}"}
     
-    async def _check_user_exists(self, login: str = None, email: str = None, phone: str = None) -> bool:
-        """Проверка существования пользователя"""
+    async def register_users_bulk(self, users: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Пакетная регистрация пользователей (импорт, административное добавление)
+        
+        Args:
+            users (List[Dict[str, Any]]): Данные пользователей с ключами как у register_user
+            
+        Returns:
+            Dict[str, Any]: Зарегистрированные логины и причины отказа по остальным
+        """
+        rejected: Dict[str, str] = {}
+        valid = []
+        
+        for index, user_data in enumerate(users):
+            key = user_data.get('login') or str(index)
+            try:
+                validation_result = self._validate_registration_data(**user_data)
+            except Exception as e:
+                # Запись с лишними или недостающими полями не прерывает импорт
+                rejected[key] = f"Некорректная запись: {str(e)}"
+                continue
+            if validation_result["success"]:
+                valid.append(user_data)
+            else:
+                rejected[key] = validation_result["error"]
+        
+        if not valid:
+            return {"success": False, "registered": [], "rejected": rejected}
+        
+        try:
+            # Хеши считаются параллельно в пуле потоков
+            salts = [self._generate_salt() for _ in valid]
+            hashes = await asyncio.gather(*(
+                self._hash_password_async(user_data['password'], salt)
+                for user_data, salt in zip(valid, salts)
+            ))
+            
+            today = date.today()
+            records = [
+                (user_data['login'], password_hash, PBKDF2_ALGORITHM, salt,
+                 user_data['email'], user_data['full_name'],
+                 user_data['passport_series'], user_data['passport_number'],
+                 user_data['birth_date'], self._calculate_age(user_data['birth_date'], today),
+                 user_data['phone'])
+                for user_data, salt, password_hash in zip(valid, salts, hashes)
+            ]
+            
+            # Конфликты пропускаются через ON CONFLICT, RETURNING сообщает,
+            # какие строки добавлены
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(self._SQL_INSERT_USERS_BULK, *map(list, zip(*records)))
+            registered = [row['login'] for row in rows]
+            
+            inserted = set(registered)
+            for record in records:
+                if record[0] not in inserted:
+                    rejected[record[0]] = "Пользователь с такими данными уже существует"
+            
+            logger.info(f"Пакетная регистрация: добавлено {len(registered)}, отклонено {len(rejected)}")
+            return {"success": True, "registered": registered, "rejected": rejected}
+            
+        except Exception as e:
+            logger.error(f"Ошибка пакетной регистрации: {e}")
+            return {"success": False, "error": f"Ошибка регистрации: {str(e)}"}
+    
+    async def _check_user_exists(self, column: str, value: str) -> bool:
+        """Проверка существования пользователя по логину, email или телефону"""
+        # Имя колонки подставляется в текст запроса, поэтому только из белого списка
+        if column not in self._USER_LOOKUP_COLUMNS:
+            raise ValueError(f"Недопустимая колонка для поиска пользователя: {column}")
+        
         try:
             async with self.pool.acquire() as conn:
-                if login:
-                    user = await conn.fetchrow('SELECT id FROM users WHERE login = $1', login)
-                    return user is not None
-                elif email:
-                    user = await conn.fetchrow('SELECT id FROM users WHERE email = $1', email)
-                    return user is not None
-                elif phone:
-                    user = await conn.fetchrow('SELECT id FROM users WHERE phone = $1', phone)
-                    return user is not None
-                return False
+                return await conn.fetchval(self._SQL_USER_EXISTS.format(column=column), value)
         except Exception as e:
             logger.error(f"Ошибка проверки пользователя: {e}")
             return False
     
+    async def _flush_last_login(self):
+        """Запись накопленных времен входа одним UPDATE"""
+        if not self._pending_last_login:
+            return
+        
+        pending, self._pending_last_login = self._pending_last_login, set()
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(self._SQL_UPDATE_LAST_LOGIN, list(pending))
+        except asyncio.CancelledError:
+            # Возвращаем пакет: его запишет финальный сброс в close()
+            self._pending_last_login |= pending
+            raise
+        except Exception as e:
+            # Возвращаем пакет, чтобы повторить запись при следующем сбросе
+            self._pending_last_login |= pending
+            logger.error(f"Ошибка обновления времени входа: {e}")
+    
+    async def _last_login_writer(self):
+        """Фоновая задача периодической записи времени последнего входа"""
+        while True:
+            await asyncio.sleep(self.LAST_LOGIN_FLUSH_INTERVAL)
+            await self._flush_last_login()
+    
     async def authenticate_user(self, identifier: str, password: str) -> Optional[Dict[str, Any]]:
         """Аутентификация пользователя по логину, email или телефону"""
         try:
             async with self.pool.acquire() as conn:
                 # Ищем пользователя по логину, email или телефону
-                user = await conn.fetchrow('''
-                    SELECT id, login, password_hash, salt, email, full_name, phone,
-                           passport_series, passport_number, birth_date, age,
-                           is_active
-                    FROM users 
-                    WHERE (login = $1 OR email = $1 OR phone = $1) AND is_active = TRUE
-                ''', identifier)
+                user = await conn.fetchrow(self._SQL_AUTHENTICATE, identifier)
                 
                 if not user:
                     return None
                 
-                # Проверяем пароль
-                password_hash = self._hash_password(password, user['salt'])
-                if password_hash != user['password_hash']:
+                # Проверяем пароль за постоянное время
+                password_hash = await self._hash_password_async(
+                    password, user['salt'], user['hash_algo']
+                )
+                if not hmac.compare_digest(password_hash, user['password_hash']):
                     return None
                 
-                # Обновляем время последнего входа
-                await conn.execute(
-                    'UPDATE users SET last_login = $1 WHERE id = $2',
-                    datetime.now(), user['id']
-                )
+                # Время последнего входа записывается фоновой задачей пакетом
+                self._pending_last_login.add(user['id'])
                 
                 return {
                     'id': user['id'],
@@ -211,7 +449,7 @@ class DatabaseManager:
         if len(login) < 3 or len(login) > 50:
             return {"success": False, "error": "Логин должен содержать от 3 до 50 символов"}
         
-        if not re.match(r'^[a-zA-Z0-9_]+$', login):
+        if not self._RE_LOGIN.match(login):
             return {"success": False, "error": "Логин может содержать только латинские буквы, цифры и подчеркивание"}
         
         # Проверка пароля
@@ -219,8 +457,7 @@ class DatabaseManager:
             return {"success": False, "error": "Пароль должен содержать минимум 6 символов"}
         
         # Проверка email
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        if not re.match(email_pattern, email):
+        if not self._RE_EMAIL.match(email):
             return {"success": False, "error": "Введите корректный email адрес"}
         
         # Проверка ФИО
@@ -239,17 +476,18 @@ class DatabaseManager:
             return {"success": False, "error": "Номер паспорта должен состоять из 6 цифр"}
         
         # Проверка даты рождения
-        if birth_date > date.today():
+        today = date.today()
+        if birth_date > today:
             return {"success": False, "error": "Дата рождения не может быть в будущем"}
         
-        age = self._calculate_age(birth_date)
+        age = self._calculate_age(birth_date, today)
         if age < 18:
             return {"success": False, "error": "Регистрация доступна только с 18 лет"}
         if age > 120:
             return {"success": False, "error": "Проверьте корректность даты рождения"}
         
         # Проверка телефона
-        phone_clean = re.sub(r'\D', '', phone)
+        phone_clean = self._RE_NONDIGIT.sub('', phone)
         if len(phone_clean) not in [10, 11]:
             return {"success": False, "error": "Введите корректный номер телефона (10-11 цифр)"}
         
@@ -257,5 +495,14 @@ class DatabaseManager:
     
     async def close(self):
         """Закрытие соединения с базой данных"""
+        if self._last_login_task:
+            self._last_login_task.cancel()
+            try:
+                await self._last_login_task
+            except asyncio.CancelledError:
+                pass
+            self._last_login_task = None
+        
         if self.pool:
+            await self._flush_last_login()
             await self.pool.close()
\ No newline at end of file
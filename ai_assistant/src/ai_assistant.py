@@ -1,8 +1,10 @@
 """Основной модуль ИИ-ассистента"""
-from typing import List, Optional, Dict, Any, AsyncGenerator
+from typing import List, Optional, Dict, Any, AsyncGenerator, Sequence, Tuple
 import asyncio
+import functools
 import logging
 import os
+import re
 import time
 
 # Импорты из той же папки
@@ -14,9 +16,77 @@ from .dialogue_memory import DialogueMemory
 from .llm_adapter import LLMAdapter, LLMError
 from .embeddings_manager import EmbeddingsManager
 from .stock_analyzer import StockAnalyzer
+from .knowledge_base import KnowledgeBase
 
 logger = logging.getLogger(__name__)
 
+# Таблицы для исправления раскладки: строятся один раз при импорте модуля
+_EN_LAYOUT = "qwertyuiop[]asdfghjkl;'zxcvbnm,./`"
+_RU_LAYOUT = "йцукенгшщзхъфывапролджэячсмитьбю.ё"
+_EN_LAYOUT_ALL = _EN_LAYOUT + _EN_LAYOUT.upper()
+_LAYOUT_MAP = str.maketrans(_EN_LAYOUT_ALL, _RU_LAYOUT + _RU_LAYOUT.upper())
+# Все символы латинской раскладки однобайтовые в UTF-8, поэтому их количество
+# считается удалением по 256-байтовой таблице bytes.translate
+_EN_LAYOUT_BYTES = _EN_LAYOUT_ALL.encode('ascii')
+
+# Ключевые слова намерений: один проход регулярным выражением вместо серии any(...)
+_INTENT_RE = re.compile(
+    r"(?P<definition>что такое|определ)"
+    r"|(?P<process>как|процесс)"
+    r"|(?P<documents>документ|нужно)"
+    r"|(?P<cost>ставк|стоимость)"
+    r"|(?P<invest>акции|инвестиц|вложить)",
+    re.IGNORECASE
+)
+# Порядок групп задает приоритет намерения при нескольких совпадениях
+_INTENT_LABELS = {
+    'definition': "ПОЛУЧИТЬ ОПРЕДЕЛЕНИЕ",
+    'process': "УЗНАТЬ ПРОЦЕСС",
+    'documents': "УЗНАТЬ ДОКУМЕНТЫ",
+    'cost': "УЗНАТЬ СТОИМОСТЬ",
+    'invest': "ИНВЕСТИЦИОННЫЙ ЗАПРОС",
+}
+_INTENT_PRIORITY = {name: i for i, name in enumerate(_INTENT_LABELS)}
+
+# Шаблоны для вопроса применяются к уже приведенной к нижнему регистру строке
+_INVEST_QUESTION_RE = re.compile(r"акции|инвестиц|вложить")
+_STOCK_QUESTION_RE = re.compile(r"акции|инвестиц")
+_OFFTOPIC_CHUNK_RE = re.compile(r"ипотек|кредит на недвижимость|вклад", re.IGNORECASE)
+_STOCK_RESPONSE_RE = re.compile(
+    r"акци|сбер|газпром|лукойл|яндекс|дивидент|портфель|инвест", re.IGNORECASE
+)
+
+_STOCK_SYMBOLS = ('GAZP', 'SBER', 'LKOH', 'YNDX', 'ROSN', 'VTBR')
+# Тикер в нижнем регистре -> тикер, в порядке приоритета _STOCK_SYMBOLS
+_SYMBOL_BY_LC = {symbol.lower(): symbol for symbol in _STOCK_SYMBOLS}
+# Инвестиционный классификатор: признак намерения и тикеры за один проход
+_INVEST_CLASSIFIER_RE = re.compile(
+    r"(?P<sym>" + "|".join(_SYMBOL_BY_LC) + r")"
+    r"|(?P<intent>акции|инвестиц|вложить|портфель|выгодн)"
+)
+
+def _classify_investment(question_lc: str) -> Tuple[bool, Optional[str]]:
+    """(инвестиционный ли вопрос, приоритетный упомянутый тикер или None)"""
+    is_invest = False
+    mentioned = set()
+    for match in _INVEST_CLASSIFIER_RE.finditer(question_lc):
+        if match.lastgroup == 'intent':
+            is_invest = True
+        else:
+            mentioned.add(match.group())
+    
+    if not is_invest:
+        return False, None
+    symbol = next((s for lc, s in _SYMBOL_BY_LC.items() if lc in mentioned), None)
+    return True, symbol
+
+_EXIT_COMMANDS = frozenset(('exit', 'quit', 'стоп'))
+
+@functools.lru_cache(maxsize=4)
+def _cached_knowledge_base(path: str, mtime: float) -> KnowledgeBase:
+    """База знаний, общая для всех экземпляров ассистента (mtime сбрасывает кэш)"""
+    return KnowledgeBase(path)
+
 class AssistantInitializationError(Exception):
     """Ошибка инициализации ассистента"""
     pass
@@ -24,14 +94,24 @@ class AssistantInitializationError(Exception):
 class SmartDeepThinkRAG:
     """Основной класс ассистента с поддержкой streaming"""
     
+    # Время жизни кэша рыночных данных, сек
+    MARKET_CACHE_TTL = 60
+    # Порог выдачи накопленных чанков ответа: по размеру (символы) или по времени (сек)
+    STREAM_FLUSH_CHARS = 64
+    STREAM_FLUSH_INTERVAL = 0.05
+    
     def __init__(self, config_path: str = "config.json"):
         try:
-            self.config = ConfigManager.load_config(config_path)
+            self.config = ConfigManager.load_frozen_config(config_path)
             self._validate_config()
             
+            # Часто используемые значения конфигурации читаются один раз
+            self._top_k = self.config['rag'].get('top_k_documents', 3)
+            
             # Инициализация компонентов
             self.embedding_manager = EmbeddingsManager(
-                self.config['embedder']['model_name']
+                self.config['embedder']['model_name'],
+                int8=self.config['embedder'].get('int8', False)
             )
             self.embedding_cache = EmbeddingCache()
             self.llm = LLMAdapter(
@@ -41,25 +121,19 @@ class SmartDeepThinkRAG:
             self.security = SecurityChecker()
             self.metrics = MetricsCollector()
             self.memory = DialogueMemory()
-
-            async def initialize_qdrant(self):
-                """Инициализация Qdrant"""
-                if self.config.get('qdrant', {}).get('enabled', True):
-                    qdrant_status = await self.embedding_manager.get_qdrant_status()
-                    logger.info(f"Статус Qdrant: {qdrant_status}")
+            # Кэш рыночных данных: (момент получения, данные)
+            self._market_cache: Optional[Tuple[float, Dict[str, Any]]] = None
             
             # Инициализация анализатора акций
             self.stock_analyzer = StockAnalyzer()
             
-            # Загрузка базы знаний и предварительные вычисления
+            # Загрузка базы знаний; модель и эмбеддинги документов готовятся в фоне
+            # при первом асинхронном вызове, ask_streaming дожидается их только
+            # перед поиском документов
             self.documents = self._load_knowledge_base()
-            self.doc_embeddings = self.embedding_manager.precompute_embeddings(
-                self.documents, 
-                self.embedding_cache
-            )
-
-            # Вызываем Qdrant
-            asyncio.create_task(self.initialize_qdrant())
+            self.doc_embeddings = None
+            self._precompute_task: Optional[asyncio.Task] = None
+            self._qdrant_task: Optional[asyncio.Task] = None
             
             logger.info(f"Система инициализирована. Документов в базе: {len(self.documents)}")
             
@@ -73,6 +147,34 @@ class SmartDeepThinkRAG:
             qdrant_status = await self.embedding_manager.get_qdrant_status()
             logger.info(f"Статус Qdrant: {qdrant_status}")
 
+    def _start_background(self) -> asyncio.Task:
+        """Запуск фоновой подготовки индекса и Qdrant в текущем event loop
+        
+        Конструктор синхронный и может работать вне цикла (ask_sync создает
+        новый цикл на каждый вызов), поэтому задачи создаются здесь. Задачу,
+        отмененную вместе с прежним циклом или не завершенную в нем, запускаем заново.
+        """
+        loop = asyncio.get_running_loop()
+        task = self._precompute_task
+        if task is None or task.cancelled() or (not task.done() and task.get_loop() is not loop):
+            self._precompute_task = asyncio.ensure_future(self._precompute_index())
+        
+        task = self._qdrant_task
+        if task is None or task.cancelled() or (not task.done() and task.get_loop() is not loop):
+            self._qdrant_task = asyncio.ensure_future(self.initialize_qdrant())
+        return self._precompute_task
+
+    async def _precompute_index(self) -> None:
+        """Фоновый расчет эмбеддингов базы знаний"""
+        try:
+            self.doc_embeddings = await self.embedding_manager.precompute_embeddings_async(
+                self.documents,
+                self.embedding_cache
+            )
+            logger.info("Эмбеддинги базы знаний рассчитаны")
+        except Exception as e:
+            logger.error(f"Ошибка расчета эмбеддингов базы знаний: {e}")
+
     def _validate_config(self):
         """Валидация конфигурации"""
         required_fields = ['model', 'rag', 'embedder']
@@ -80,8 +182,8 @@ class SmartDeepThinkRAG:
             if field not in self.config:
                 raise ValueError(f"Отсутствует обязательное поле конфигурации: {field}")
 
-    def _load_knowledge_base(self) -> List[str]:
-        """Загрузка базы знаний из файла"""
+    def _load_knowledge_base(self) -> Sequence[str]:
+        """Загрузка базы знаний из файла (документы читаются лениво через mmap)"""
         knowledge_base_paths = [
             "knowledge_base.txt",
             os.path.join(os.path.dirname(__file__), '..', 'data', 'knowledge_base.txt'),
@@ -90,10 +192,10 @@ class SmartDeepThinkRAG:
         
         for kb_path in knowledge_base_paths:
             try:
-                with open(kb_path, 'r', encoding='utf-8') as f:
-                    documents = [line.strip() for line in f if line.strip()]
-                    logger.info(f"Загружена база знаний из {kb_path}: {len(documents)} документов")
-                    return documents
+                kb_path = os.path.abspath(kb_path)
+                documents = _cached_knowledge_base(kb_path, os.path.getmtime(kb_path))
+                logger.info(f"Загружена база знаний из {kb_path}: {len(documents)} документов")
+                return documents
             except FileNotFoundError:
                 continue
             except Exception as e:
@@ -103,9 +205,15 @@ class SmartDeepThinkRAG:
         logger.warning("База знаний не найдена")
         return []
 
+    async def _get_question_embedding(self, clean_question: str) -> Tuple[Any, bool]:
+        """Эмбеддинг вопроса через LRU-кэш менеджера, возвращает (вектор, попадание в кэш)"""
+        return await self.embedding_manager.get_embedding_with_hit(clean_question)
+
     async def ask_streaming(self, question: str) -> AsyncGenerator[str, None]:
         """Асинхронный метод с улучшенным DeepThink и аналитикой акций"""
         start_time = time.time()
+        market_task = None
+        precompute_task = self._start_background()
         
         try:
             # Извлекаем флаги и определяем режимы
@@ -117,9 +225,20 @@ class SmartDeepThinkRAG:
                 yield "АКТИВИРОВАН РЕЖИМ DEEPTHINK\n"
                 yield "=" * 50 + "\n"
             
-            # Проверка безопасности
-            is_safe, reason = await self.security.check(question)
+            # Нижний регистр вопроса считается один раз на запрос
+            question_lower = clean_question.lower()
+            
+            # Для инвестиционных вопросов рыночные данные запрашиваются сразу,
+            # параллельно с проверкой безопасности и эмбеддингом
+            is_invest, symbol = _classify_investment(question_lower)
+            if is_invest:
+                market_task = asyncio.create_task(self._get_real_market_data())
+            
+            # Проверка безопасности (заодно определяет намерение для метрик)
+            # синхронна; отклоненный запрос не тратит время на эмбеддинг
+            is_safe, reason, intent = self.security.check_sync(question)
             if not is_safe:
+                self.metrics.log_query(clean_question, intent, time.time() - start_time, success=False)
                 if deepthink_mode:
                     yield f"АНАЛИЗ БЕЗОПАСНОСТИ: {reason}\n"
                     yield "Запрос отклонен по политике безопасности\n"
@@ -128,28 +247,27 @@ class SmartDeepThinkRAG:
                     yield reason
                 return
             
-            # Получаем информацию для ответа
-            question_embedding = await self.embedding_manager.get_embedding(clean_question)
+            question_embedding, cache_hit = await self._get_question_embedding(clean_question)
+            
+            # Получаем информацию для ответа (индекс мог еще строиться)
+            await precompute_task
             similar_docs = await self.embedding_manager.find_similar(
-                clean_question, question_embedding, self.doc_embeddings, self.documents, top_k=3
+                clean_question, question_embedding, top_k=self._top_k
             )
             
             # Анализ акций (если применимо)
             investment_analysis = None
-            question_lower = clean_question.lower()
             
-            if any(word in question_lower for word in ['акции', 'инвестиц', 'вложить', 'куда вложить', 'портфель', 'выгодн']):
-                market_data = await self._get_real_market_data()
+            if market_task:
+                market_data = await market_task
                 
-                # Анализ конкретной акции
-                for symbol in ['GAZP', 'SBER', 'LKOH', 'YNDX', 'ROSN', 'VTBR']:
-                    if symbol.lower() in question_lower:
-                        investment_analysis = await self.stock_analyzer.analyze_single_stock(symbol, market_data)
-                        break
+                # Анализ конкретной акции (первый тикер в порядке _STOCK_SYMBOLS)
+                if symbol:
+                    investment_analysis = self.stock_analyzer.analyze_single_stock(symbol, market_data)
                 
                 # Общий инвестиционный анализ
                 if not investment_analysis:
-                    investment_analysis = await self.stock_analyzer.analyze_investment_query(clean_question, market_data)
+                    investment_analysis = self.stock_analyzer.analyze_investment_query(clean_question, market_data)
             
             # DeepThink анализ
             if deepthink_mode:
@@ -192,18 +310,33 @@ class SmartDeepThinkRAG:
                 yield "Ответ: "
             
             # Генерация ответа от LLM с проверкой релевантности
-            full_response = ""
+            response_parts = []
             relevant_chunks = []
+            # Релевантные чанки копятся и выдаются пачками
+            pending = []
+            pending_len = 0
+            last_flush = time.monotonic()
             
             async for chunk in self.llm.generate_answer_streaming(clean_question, similar_docs, deepthink_mode, flags):
+                response_parts.append(chunk)
                 # Проверяем релевантность чанка
-                if self._is_relevant_chunk(chunk, clean_question):
+                if self._is_relevant_chunk(chunk, question_lower):
                     relevant_chunks.append(chunk)
-                    yield chunk
-                full_response += chunk
+                    pending.append(chunk)
+                    pending_len += len(chunk)
+                    now = time.monotonic()
+                    if pending_len >= self.STREAM_FLUSH_CHARS or now - last_flush >= self.STREAM_FLUSH_INTERVAL:
+                        yield "".join(pending)
+                        pending.clear()
+                        pending_len = 0
+                        last_flush = now
+            
+            if pending:
+                yield "".join(pending)
+            full_response = "".join(response_parts)
             
             # Если ответ нерелевантен - даем запаcной вариант
-            if not self._is_response_relevant(full_response, clean_question) and investment_analysis:
+            if not self._is_response_relevant(full_response, question_lower) and investment_analysis:
                 yield "\n\nНа основе анализа рекомендую:\n"
                 if 'stocks' in investment_analysis:
                     for stock in investment_analysis['stocks'][:3]:
@@ -217,28 +350,25 @@ class SmartDeepThinkRAG:
             self.memory.add_message('assistant', full_response)
             
             response_time = time.time() - start_time
+            self.metrics.log_query(clean_question, intent, response_time, cache_hit=cache_hit)
             yield f"\n\n⏱Время ответа: {response_time:.2f} сек"
             
         except Exception as e:
             logger.error(f"Критическая ошибка в ask_streaming: {e}", exc_info=True)
             yield f"Произошла ошибка: {e}"
+        finally:
+            # Отклоненный или прерванный запрос не ждет рыночных данных
+            if market_task and not market_task.done():
+                market_task.cancel()
 
     async def _generate_deepthink_analysis(self, question: str, similar_docs: List[str], investment_analysis: Any) -> str:
         """Генерация анализа для DeepThink режима"""
         analysis = []
         
         # Анализ намерения
-        question_lower = question.lower()
-        if any(word in question_lower for word in ['что такое', 'определ']):
-            intent = "ПОЛУЧИТЬ ОПРЕДЕЛЕНИЕ"
-        elif any(word in question_lower for word in ['как', 'процесс']):
-            intent = "УЗНАТЬ ПРОЦЕСС"
-        elif any(word in question_lower for word in ['документ', 'нужно']):
-            intent = "УЗНАТЬ ДОКУМЕНТЫ" 
-        elif any(word in question_lower for word in ['ставк', 'стоимость']):
-            intent = "УЗНАТЬ СТОИМОСТЬ"
-        elif any(word in question_lower for word in ['акции', 'инвестиц', 'вложить']):
-            intent = "ИНВЕСТИЦИОННЫЙ ЗАПРОС"
+        groups = {m.lastgroup for m in _INTENT_RE.finditer(question)}
+        if groups:
+            intent = _INTENT_LABELS[min(groups, key=_INTENT_PRIORITY.__getitem__)]
         else:
             intent = "ℹОБЩИЙ ЗАПРОС"
         
@@ -263,6 +393,11 @@ class SmartDeepThinkRAG:
 
     async def _get_real_market_data(self) -> Dict[str, Any]:
         """Получение реальных рыночных данных для анализа"""
+        if self._market_cache:
+            fetched_at, cached = self._market_cache
+            if time.monotonic() - fetched_at < self.MARKET_CACHE_TTL:
+                return cached
+        
         try:
             # Используем существующие парсеры для получения реальных данных
             from ..parsers.financial_parser import FinancialDataParser
@@ -270,63 +405,59 @@ class SmartDeepThinkRAG:
             parser = FinancialDataParser()
             market_data = {}
             
-            # Получаем данные по основным акциям
-            symbols = ['SBER', 'GAZP', 'LKOH', 'YNDX', 'ROSN', 'VTBR']
+            # Запрашиваем все акции параллельно
+            try:
+                results = await asyncio.gather(
+                    *(parser.get_stock_price(symbol) for symbol in _STOCK_SYMBOLS),
+                    return_exceptions=True
+                )
+            finally:
+                await parser.close()
             
-            for symbol in symbols:
-                try:
-                    stock_data = await parser.get_stock_price(symbol)
-                    if 'error' not in stock_data:
-                        market_data[symbol] = {
-                            'last_price': stock_data.get('last_price'),
-                            'change': stock_data.get('change', 0),
-                            'change_percent': stock_data.get('change_percent', 0),
-                            'volume': stock_data.get('volume', 0)
-                        }
-                except Exception as e:
-                    logger.warning(f"Не удалось получить данные по {symbol}: {e}")
-                    # Используем заглушку если API не доступно
-                    market_data[symbol] = await self._get_fallback_data(symbol)
+            for symbol, stock_data in zip(_STOCK_SYMBOLS, results):
+                # Акции без данных пропускаем: анализатор сообщит об их отсутствии
+                if isinstance(stock_data, BaseException):
+                    logger.warning(f"Не удалось получить данные по {symbol}: {stock_data}")
+                    continue
+                if 'error' not in stock_data:
+                    market_data[symbol] = {
+                        'last_price': stock_data.get('last_price'),
+                        'change': stock_data.get('change', 0),
+                        'change_percent': stock_data.get('change_percent', 0),
+                        'volume': stock_data.get('volume', 0)
+                    }
             
-            await parser.close()
+            if market_data:
+                self._market_cache = (time.monotonic(), market_data)
             return market_data
             
         except Exception as e:
             logger.error(f"Ошибка получения рыночных данных: {e}")
-            return await self._get_fallback_data()
-        
+            return {}
 
-    def _is_relevant_chunk(self, chunk: str, question: str) -> bool:
-        """Проверка релевантности чанка вопросу"""
-        question_lower = question.lower()
-        chunk_lower = chunk.lower()
-        
+    def _is_relevant_chunk(self, chunk: str, question_lc: str) -> bool:
+        """Проверка релевантности чанка вопросу (вопрос в нижнем регистре)"""
         # Если вопрос про акции, а ответ про ипотеку - нерелевантно
-        if any(word in question_lower for word in ['акции', 'инвестиц', 'вложить']):
-            if any(word in chunk_lower for word in ['ипотек', 'кредит на недвижимость', 'вклад']):
-                return False
+        if _INVEST_QUESTION_RE.search(question_lc) and _OFFTOPIC_CHUNK_RE.search(chunk):
+            return False
         
         return True
 
-    def _is_response_relevant(self, response: str, question: str) -> bool:
-        """Проверка релевантности всего ответа"""
-        question_lower = question.lower()
-        response_lower = response.lower()
+    def _is_response_relevant(self, response: str, question_lc: str) -> bool:
+        """Проверка релевантности всего ответа (вопрос в нижнем регистре)"""
+        if not _STOCK_QUESTION_RE.search(question_lc):
+            return False
         
-        relevant_keywords = []
-        if any(word in question_lower for word in ['акции', 'инвестиц']):
-            relevant_keywords = ['акци', 'сбер', 'газпром', 'лукойл', 'яндекс', 'дивидент', 'портфель', 'инвест']
-        
-        return any(keyword in response_lower for keyword in relevant_keywords)
+        return _STOCK_RESPONSE_RE.search(response) is not None
 
     async def ask(self, question: str) -> str:
         """Асинхронный метод для прямого вызова из main.py"""
-        full_response = ""
+        parts = []
         async for chunk in self.ask_streaming(question):
             print(chunk, end='', flush=True)
-            full_response += chunk
+            parts.append(chunk)
         print()  # Конечный перенос строки
-        return full_response
+        return "".join(parts)
     
     async def ask_streaming_wrapper(self, question: str) -> None:
         """Обертка для вывода стриминга напрямую в консоль"""
@@ -335,37 +466,30 @@ class SmartDeepThinkRAG:
         print()  # Конечный перенос строки
 
     def ask_sync(self, question: str) -> str:
-        """Синхронная обертка для использования в асинхронном контексте"""
-        import asyncio
-        
+        """Синхронная обертка для вызова вне event loop"""
         try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                future = asyncio.run_coroutine_threadsafe(self.ask(question), loop)
-                return future.result()
-            else:
-                return loop.run_until_complete(self.ask(question))
+            asyncio.get_running_loop()
         except RuntimeError:
             return asyncio.run(self.ask(question))
+        
+        # Блокирующее ожидание внутри работающего цикла привело бы к взаимоблокировке
+        raise RuntimeError("ask_sync нельзя вызывать из работающего event loop, используйте await ask()")
+
+    async def close(self):
+        """Освобождение сетевых ресурсов ассистента"""
+        await self.llm.close()
 
     def _fix_keyboard_layout(self, text: str) -> str:
         """Исправление текста, набранного в английской раскладке вместо русской"""
         if not text:
             return text
 
-        en_chars = "qwertyuiop[]asdfghjkl;'zxcvbnm,./`"
-        ru_chars = "йцукенгшщзхъфывапролджэячсмитьбю.ё"
-        en_upper = en_chars.upper()
-        ru_upper = ru_chars.upper()
-
-        char_map = str.maketrans(en_chars + en_upper, ru_chars + ru_upper)
-
-        latin_count = sum(1 for c in text if c in en_chars + en_upper)
-        total_len = len(text)
-        latin_ratio = (latin_count / total_len) if total_len > 0 else 0.0
+        raw = text.encode('utf-8')
+        latin_count = len(raw) - len(raw.translate(None, _EN_LAYOUT_BYTES))
+        latin_ratio = latin_count / len(text)
 
         if latin_ratio > 0.3:
-            fixed = text.translate(char_map)
+            fixed = text.translate(_LAYOUT_MAP)
             logger.info("Исправлена раскладка: '%s' -> '%s'", text, fixed)
             return fixed
 
@@ -384,7 +508,7 @@ if __name__ == "__main__":
         
         while True:
             question = input("\nВаш вопрос: ").strip()
-            if question.lower() in ['exit', 'quit', 'стоп']:
+            if question.lower() in _EXIT_COMMANDS:
                 print("До свидания!")
                 break
             if not question:
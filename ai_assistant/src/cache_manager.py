@@ -1,58 +1,222 @@
 import os
+import time
+import atexit
 import pickle
 import hashlib
-from typing import Any, Dict
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+import numpy as np
 # добавляем импорт
 from .logging_setup import suppress_stdout
 
+def text_key(text: str) -> int:
+    """64-битный ключ текста для кэшей эмбеддингов
+
+    BLAKE2b из стандартной библиотеки, усеченный до 8 байт и взятый как
+    целое: без hex-строки и с дешевым хэшированием в dict. Ключи сохраняются
+    в файл кэша, поэтому функция не должна зависеть от установленных пакетов.
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
 class EmbeddingCache:
-    """Кэш для эмбеддингов с персистентностью"""
+    """Кэш для эмбеддингов с персистентностью
+
+    Все векторы хранятся строками одной непрерывной float32-матрицы,
+    ключ текста отображается в номер строки. На диске матрица лежит в .npy
+    и при старте отображается в память (mmap): страницы читаются при первом
+    обращении, а не целиком при загрузке. Ключи строк - соседний .ids.npy.
+    """
+    # Запись на диск: после FLUSH_EVERY новых векторов или FLUSH_SECS секунд
+    FLUSH_EVERY = 64
+    FLUSH_SECS = 5.0
+    # Размер пакета при кодировании промахов
+    ENCODE_BATCH_SIZE = 64
+    
     def __init__(self, cache_file: str = 'embeddings_cache.pkl'):
         self.cache_file = cache_file
-        self.cache = self._load_cache()
+        base = os.path.splitext(cache_file)[0]
+        self.matrix_file = base + '.npy'
+        self.ids_file = base + '.ids.npy'
+        
+        self._ids: Dict[int, int] = {}
+        self._mat = np.empty((0, 0), dtype=np.float32)
+        self._n = 0
+        self._dirty = 0
+        self._last_flush = time.monotonic()
+        # Векторы из кэша прежнего формата {md5(текст): вектор}
+        self._legacy: Dict[str, Any] = {}
+        self._load_cache()
+
+        atexit.register(self.flush)
     
-    def _load_cache(self) -> Dict[str, Any]:
-        if os.path.exists(self.cache_file):
+    def __len__(self) -> int:
+        return self._n
+    
+    @property
+    def matrix(self) -> np.ndarray:
+        """Заполненная часть матрицы эмбеддингов (представление, без копирования)"""
+        return self._mat[:self._n]
+    
+    def _load_cache(self) -> None:
+        if os.path.exists(self.matrix_file):
             try:
-                with open(self.cache_file, 'rb') as f:
-                    return pickle.load(f)
+                self._load_mapped()
+                return
             except Exception:
-                return {}
-        return {}
+                self._ids, self._n = {}, 0
+        
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'rb') as f:
+                cache = pickle.load(f)
+        except Exception:
+            return
+        
+        # Прежний формат {md5(текст): вектор}: по ключу md5 текст не восстановить,
+        # поэтому векторы переносятся в матрицу при первом обращении к тексту
+        if isinstance(cache, dict):
+            self._legacy = {k: v for k, v in cache.items() if isinstance(k, str)}
+    
+    def _load_mapped(self) -> None:
+        """Отображение матрицы в память; записи идут в копию при первом росте"""
+        keys = np.load(self.ids_file)
+        mat = np.load(self.matrix_file, mmap_mode='r')
+        if mat.dtype != np.float32 or mat.ndim != 2 or len(mat) != len(keys):
+            # Файлы от прерванной записи не согласованы между собой
+            raise ValueError("Файлы кэша эмбеддингов не согласованы")
+        self._mat = mat
+        self._ids = dict(zip(keys.tolist(), range(len(keys))))
+        self._n = len(mat)
+    
+    def _from_legacy(self, text: str) -> Optional[Any]:
+        """Вектор текста из кэша прежнего формата (извлекается один раз)"""
+        if not self._legacy:
+            return None
+        return self._legacy.pop(hashlib.md5(text.encode()).hexdigest(), None)
     
     def _save_cache(self) -> None:
         try:
-            with open(self.cache_file, 'wb') as f:
-                pickle.dump(self.cache, f)
+            # Ключи в порядке строк матрицы
+            keys = np.empty(self._n, dtype=np.uint64)
+            keys[list(self._ids.values())] = list(self._ids.keys())
+            # Запись во временные файлы и атомарная замена: сбой не оставит битый кэш,
+            # а уже отображенный старый файл остается валидным до закрытия
+            for path, array in ((self.ids_file, keys), (self.matrix_file, self.matrix)):
+                tmp_file = path + '.tmp'
+                with open(tmp_file, 'wb') as f:
+                    np.save(f, array)
+                os.replace(tmp_file, path)
         except Exception:
             pass
+        self._dirty = 0
+        self._last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        """Запись несохраненных векторов на диск"""
+        if self._dirty:
+            self._save_cache()
+
+    def _maybe_flush(self) -> None:
+        if (self._dirty >= self.FLUSH_EVERY
+                or time.monotonic() - self._last_flush > self.FLUSH_SECS):
+            self.flush()
+
+    def _key(self, text: str) -> int:
+        return text_key(text)
+
+    def _append(self, key: int, vector: np.ndarray) -> int:
+        """Добавление строки в матрицу; при заполнении емкость удваивается
 
-    def _key(self, text: str) -> str:
-        return hashlib.md5(text.encode()).hexdigest()
+        Отображенная с диска матрица заполнена целиком, поэтому первая же
+        запись переносит ее в память процесса и файл не изменяется.
+        """
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        if self._n and self._mat.shape[1] != len(vector):
+            # Размерность сменилась вместе с моделью: старые векторы непригодны
+            self._ids = {}
+            self._n = 0
+        if self._n == len(self._mat) or self._mat.shape[1] != len(vector):
+            capacity = max(16, 2 * len(self._mat))
+            grown = np.empty((capacity, len(vector)), dtype=np.float32)
+            if self._n:
+                grown[:self._n] = self._mat[:self._n]
+            self._mat = grown
+        
+        row = self._n
+        self._mat[row] = vector
+        self._ids[key] = row
+        self._n += 1
+        return row
 
-    def get_embedding(self, text: str, embedder: Any) -> Any:
+    def _row(self, text: str, embedder: Any) -> int:
         key = self._key(text)
-        if key in self.cache:
-            return self.cache[key]
-        # Подавляем stdout/stderr во время вычисления эмбеддинга
-        with suppress_stdout():
-            embedding = embedder.encode([text])
-        emb = embedding[0] if isinstance(embedding, (list, tuple)) else embedding
-        self.cache[key] = emb
-        self._save_cache()
-        return emb
+        row = self._ids.get(key)
+        if row is not None:
+            return row
+        vector = self._from_legacy(text)
+        if vector is None:
+            # Подавляем stdout/stderr во время вычисления эмбеддинга
+            with suppress_stdout():
+                vector = embedder.encode([text])[0]
+        row = self._append(key, vector)
+        self._dirty += 1
+        return row
+
+    def get_embedding(self, text: str, embedder: Any) -> np.ndarray:
+        """Эмбеддинг текста формы (1, D)"""
+        row = self._row(text, embedder)
+        self._maybe_flush()
+        return self._mat[row:row + 1]
+
+    def get_embeddings(self, texts: Sequence[str], embedder: Any) -> np.ndarray:
+        """Матрица эмбеддингов (N, D) для набора текстов одной выборкой строк"""
+        keys = [self._key(text) for text in texts]
+        
+        # Промахи (без повторов) кодируются моделью одним пакетным вызовом
+        missing = {}
+        migrated = 0
+        for key, text in zip(keys, texts):
+            if key not in self._ids and key not in missing:
+                vector = self._from_legacy(text)
+                if vector is not None:
+                    self._append(key, vector)
+                    migrated += 1
+                else:
+                    missing[key] = text
+        self._dirty += migrated
+        
+        if missing:
+            with suppress_stdout():
+                vectors = embedder.encode(
+                    list(missing.values()),
+                    batch_size=self.ENCODE_BATCH_SIZE,
+                    show_progress_bar=False
+                )
+            for key, vector in zip(missing, vectors):
+                self._append(key, vector)
+            self._dirty += len(missing)
+        if missing or migrated:
+            self.flush()
+        
+        return self._mat[[self._ids[key] for key in keys]]
 
 class MemoryOptimizedCache:
-    """Кэш с ограничением по памяти"""
+    """LRU-кэш с ограничением по числу элементов"""
     def __init__(self, max_size: int = 1000):
         self.max_size = max_size
-        self.cache: Dict[str, Any] = {}
+        self.cache: "OrderedDict[str, Any]" = OrderedDict()
     
     def get(self, key: str) -> Any:
-        return self.cache.get(key)
+        value = self.cache.get(key)
+        if value is not None:
+            self.cache.move_to_end(key)
+        return value
     
     def set(self, key: str, value: Any) -> None:
-        if len(self.cache) >= self.max_size:
-            # Удаляем первый элемент при переполнении
-            self.cache.pop(next(iter(self.cache)))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        elif len(self.cache) >= self.max_size:
+            # Удаляем давно не использованный элемент при переполнении
+            self.cache.popitem(last=False)
         self.cache[key] = value
\ No newline at end of file
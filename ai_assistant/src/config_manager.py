@@ -1,14 +1,110 @@
 import os
+import copy
 import json
 import logging
-from typing import Dict, Any, Optional
+import functools
+from types import MappingProxyType
+from typing import Dict, Any, Mapping, Optional, Tuple
 from dotenv import load_dotenv
 
+# orjson необязателен: без него используется стандартный json
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 logger = logging.getLogger(__name__)
 
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Имя конфига -> найденный абсолютный путь
+_resolved_paths: Dict[str, str] = {}
+
+@functools.lru_cache(maxsize=1)
+def _load_dotenv_once() -> None:
+    """.env читается один раз за процесс"""
+    load_dotenv()
+
+@functools.lru_cache(maxsize=32)
+def _candidate_paths(path: str) -> tuple:
+    """Возможные абсолютные пути к конфигу в порядке приоритета"""
+    return (
+        os.path.abspath(path),  # Текущая директория
+        os.path.abspath(os.path.join(_MODULE_DIR, '..', 'config', path)),  # В папке config
+        os.path.abspath(os.path.join(_MODULE_DIR, path))  # В папке с модулем
+    )
+
+@functools.lru_cache(maxsize=8)
+def _read_config_file(path: str, mtime: float) -> Dict[str, Any]:
+    """Чтение и разбор JSON-конфига; повторно файл читается только при смене mtime"""
+    with open(path, 'rb') as f:
+        return _json_loads(f.read())
+
+# Значения по умолчанию, поверх которых накладывается конфиг из файла
+_DEFAULT_CONFIG: Dict[str, Any] = {
+    'model': {
+        'name': 'qwen2.5:0.5b',
+        'temperature': 0.1
+    },
+    'rag': {
+        'top_k_documents': 3
+    },
+    'embedder': {
+        'model_name': 'cointegrated/rubert-tiny2'
+    }
+}
+
+def _deep_merge(base: Mapping[str, Any], override: Mapping[str, Any]) -> Dict[str, Any]:
+    """Рекурсивное слияние: вложенные секции дополняются, а не заменяются целиком"""
+    result = copy.deepcopy(dict(base))
+    for key, value in override.items():
+        if isinstance(value, Mapping) and isinstance(result.get(key), Mapping):
+            result[key] = _deep_merge(result[key], value)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+def _locate_config(path: str) -> Optional[Tuple[str, float]]:
+    """Поиск конфига: (абсолютный путь, mtime) первого доступного файла или None"""
+    # Сначала пробуем уже найденный ранее путь, затем все возможные места
+    config_paths = _candidate_paths(path)
+    resolved = _resolved_paths.get(path)
+    if resolved:
+        config_paths = (resolved,) + tuple(p for p in config_paths if p != resolved)
+
+    for config_path in config_paths:
+        try:
+            mtime = os.path.getmtime(config_path)
+            _read_config_file(config_path, mtime)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logger.warning(f"Ошибка загрузки конфигурации {config_path}: {e}")
+            continue
+        _resolved_paths[path] = config_path
+        return config_path, mtime
+
+    logger.warning(f"Конфигурация {path} не найдена, используются значения по умолчанию")
+    return None
+
+@functools.lru_cache(maxsize=8)
+def _frozen_config(config_path: Optional[str], mtime: float) -> Mapping[str, Any]:
+    """Замороженный конфиг с дефолтами; пересобирается только при смене файла"""
+    if config_path is None:
+        return ConfigManager.freeze(_DEFAULT_CONFIG)
+    return ConfigManager.freeze(_deep_merge(_DEFAULT_CONFIG, _read_config_file(config_path, mtime)))
+
 class ConfigManager:
     """Менеджер конфигурации приложения"""
     
+    @staticmethod
+    def freeze(config: Mapping[str, Any]) -> Mapping[str, Any]:
+        """Рекурсивная заморозка конфигурации в MappingProxyType (только чтение)"""
+        return MappingProxyType({
+            key: ConfigManager.freeze(value) if isinstance(value, Mapping) else value
+            for key, value in config.items()
+        })
+    
     @staticmethod
     def load_config(path: str, default: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Загрузка конфигурации из JSON файла
@@ -20,44 +116,28 @@ class ConfigManager:
         Returns:
             Dict[str, Any]: Загруженная конфигурация
         """
-        load_dotenv()
-        
-        # Определяем возможные пути к конфигу
-        config_paths = [
-            path,  # Текущая директория
-            os.path.join(os.path.dirname(__file__), '..', 'config', path),  # В папке config
-            os.path.join(os.path.dirname(__file__), path)  # В папке с модулем
-        ]
+        _load_dotenv_once()
         
-        # Устанавливаем дефолтные значения
         if default is None:
-            default = {
-                'model': {
-                    'name': 'qwen2.5:0.5b',
-                    'temperature': 0.1
-                },
-                'rag': {
-                    'top_k_documents': 3
-                },
-                'embedder': {
-                    'model_name': 'cointegrated/rubert-tiny2'
-                }
-            }
-
-        # Пробуем загрузить конфиг из всех возможных мест
-        for config_path in config_paths:
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    logger.info(f"Загружена конфигурация из {config_path}")
-                    # Обновляем дефолтные значения загруженными
-                    default.update(config)
-                    return default
-            except FileNotFoundError:
-                continue
-            except Exception as e:
-                logger.warning(f"Ошибка загрузки конфигурации {config_path}: {e}")
-                continue
-
-        logger.warning(f"Конфигурация {path} не найдена, используются значения по умолчанию")
-        return default
\ No newline at end of file
+            default = _DEFAULT_CONFIG
+        
+        located = _locate_config(path)
+        if located is None:
+            return copy.deepcopy(default)
+        
+        config_path, mtime = located
+        logger.info(f"Загружена конфигурация из {config_path}")
+        return _deep_merge(default, _read_config_file(config_path, mtime))
+    
+    @staticmethod
+    def load_frozen_config(path: str) -> Mapping[str, Any]:
+        """Конфигурация с дефолтами, замороженная и общая для всех экземпляров
+        
+        Файл перечитывается и сливается с дефолтами только при смене его mtime.
+        """
+        _load_dotenv_once()
+        
+        located = _locate_config(path)
+        if located is None:
+            return _frozen_config(None, 0.0)
+        return _frozen_config(*located)
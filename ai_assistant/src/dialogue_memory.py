@@ -1,30 +1,67 @@
 from typing import List, Dict, Any
 import time
 
+import numpy as np
+
 class DialogueMemory:
-    """Память диалога с поддержкой временного окна"""
-    
+    """Память диалога с поддержкой временного окна
+
+    Сообщения хранятся кольцевым буфером в виде параллельных массивов:
+    отметки времени (numpy), роли и тексты. Сообщения добавляются по
+    возрастанию времени, поэтому начало окна ищется бинарным поиском.
+    """
+
     def __init__(self, max_messages: int = 10):
-        self.messages: List[Dict[str, Any]] = []
         self.max_messages = max_messages
+        self._ts = np.empty(max_messages, dtype=np.float64)
+        self._roles: List[str] = [''] * max_messages
+        self._contents: List[str] = [''] * max_messages
+        self._start = 0
+        self._n = 0
 
     def add_message(self, role: str, content: str) -> None:
         """Добавление нового сообщения в память"""
-        message = {
-            'role': role,
-            'content': content,
-            'timestamp': time.time()
+        if not self.max_messages:
+            return
+
+        if self._n < self.max_messages:
+            pos = (self._start + self._n) % self.max_messages
+            self._n += 1
+        else:
+            # Буфер заполнен: перезаписываем самое старое сообщение
+            pos = self._start
+            self._start = (self._start + 1) % self.max_messages
+
+        self._ts[pos] = time.time()
+        self._roles[pos] = role
+        self._contents[pos] = content
+
+    def _slots(self, first: int = 0) -> List[int]:
+        """Физические позиции сообщений с логического номера first, от старых к новым"""
+        return [(self._start + j) % self.max_messages for j in range(first, self._n)]
+
+    def _message(self, pos: int) -> Dict[str, Any]:
+        return {
+            'role': self._roles[pos],
+            'content': self._contents[pos],
+            'timestamp': float(self._ts[pos])
         }
-        
-        self.messages.append(message)
-        if len(self.messages) > self.max_messages:
-            self.messages.pop(0)
+
+    @property
+    def messages(self) -> List[Dict[str, Any]]:
+        """Все сообщения в памяти, от старых к новым"""
+        return [self._message(pos) for pos in self._slots()]
 
     def get_context(self, window_minutes: int = 30) -> List[Dict[str, Any]]:
         """Получение контекста в пределах временного окна"""
         cutoff = time.time() - (window_minutes * 60)
-        return [msg for msg in self.messages if msg['timestamp'] >= cutoff]
+        timestamps = np.roll(self._ts, -self._start)[:self._n] if self._n else self._ts[:0]
+        first = int(np.searchsorted(timestamps, cutoff, side='left'))
+        return [self._message(pos) for pos in self._slots(first)]
 
     def clear(self) -> None:
         """Очистка памяти"""
-        self.messages.clear()
\ No newline at end of file
+        self._roles = [''] * self.max_messages
+        self._contents = [''] * self.max_messages
+        self._start = 0
+        self._n = 0
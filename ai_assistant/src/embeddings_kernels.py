@@ -0,0 +1,60 @@
+"""Вычислительные ядра для локального поиска по эмбеддингам"""
+import numpy as np
+
+# Numba необязательна: без нее используется BLAS через NumPy
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Выше этого числа строк BLAS gemv (np.dot) быстрее простого JIT-цикла
+NUMBA_MAX_ROWS = 4096
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _dot_rows(docs, query, out):
+        for i in prange(docs.shape[0]):
+            s = 0.0
+            for j in range(docs.shape[1]):
+                s += docs[i, j] * query[j]
+            out[i] = s
+
+def cosine_scores(docs: np.ndarray, query: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Скалярные произведения нормированных строк docs с нормированным query в out
+
+    np.dot для C-непрерывных float32 матрицы и вектора вызывает BLAS sgemv.
+    """
+    if NUMBA_AVAILABLE and len(docs) <= NUMBA_MAX_ROWS:
+        _dot_rows(docs, query, out)
+    else:
+        np.dot(docs, query, out=out)
+    return out
+
+def warmup(dim: int) -> None:
+    """Прогрев JIT-компиляции на фиктивной матрице 1xD"""
+    if NUMBA_AVAILABLE:
+        docs = np.zeros((1, dim), dtype=np.float32)
+        cosine_scores(docs, np.zeros(dim, dtype=np.float32), np.empty(1, dtype=np.float32))
+
+def quantize_int8(x: np.ndarray) -> tuple:
+    """Квантование в int8 с масштабом max|x|/127 на вектор (строку матрицы)
+
+    Возвращает (int8-массив той же формы, float32-масштабы: по одному на строку).
+    """
+    rows = np.atleast_2d(np.asarray(x, dtype=np.float32))
+    scales = (np.abs(rows).max(axis=1) / 127.0).astype(np.float32)
+    quantized = np.zeros(rows.shape, dtype=np.float32)
+    np.divide(rows, scales[:, None], out=quantized, where=scales[:, None] > 0)
+    return np.round(quantized).astype(np.int8).reshape(np.shape(x)), scales
+
+def int8_scores(docs_i8: np.ndarray, doc_scales: np.ndarray,
+                query: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Близость по int8-матрице: целочисленная свертка с обратным масштабированием в out"""
+    q_i8, (q_scale,) = quantize_int8(query)
+    if not q_scale:
+        out[:] = 0.0
+        return out
+    np.multiply(np.matmul(docs_i8, q_i8, dtype=np.int32), doc_scales, out=out)
+    out *= q_scale
+    return out
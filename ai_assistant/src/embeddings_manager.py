@@ -1,53 +1,145 @@
-from typing import List, Dict, Any
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import asyncio
 from .logging_setup import suppress_stdout
 import logging
 import os
+import threading
 from .qdrant_manager import QdrantManager
+from . import embeddings_kernels
+from .knowledge_base import KnowledgeBase
+from .cache_manager import text_key
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class EmbeddingsManager:
     """Управление эмбеддингами с Qdrant"""
     
-    def __init__(self, model_name: str = "cointegrated/rubert-tiny2", use_qdrant: bool = True):
+    # С этого числа документов частичная сортировка выгоднее полной
+    ARGPARTITION_MIN_DOCS = 64
+    # Емкость LRU-кэша эмбеддингов повторяющихся запросов
+    HOT_CACHE_SIZE = 2048
+    
+    def __init__(self, model_name: str = "cointegrated/rubert-tiny2", use_qdrant: bool = True,
+                 int8: bool = False):
         os.environ['TOKENIZERS_PARALLELISM'] = 'false'
         os.environ['HF_DISABLE_TQDM'] = '1'
 
-        try:
-            with suppress_stdout():
-                self.model = SentenceTransformer(model_name)
-            logger.info(f"Модель эмбеддингов {model_name} успешно загружена")
-        except Exception as e:
-            logger.error(f"Ошибка инициализации модели эмбеддингов: {e}")
-            raise RuntimeError(f"Не удалось инициализировать модель эмбеддингов: {e}")
+        # Модель загружается при первом обращении, а не при создании менеджера
+        self.model_name = model_name
+        self._model: Optional[SentenceTransformer] = None
+        self._model_lock = threading.Lock()
+        
+        # Горячий LRU-кэш эмбеддингов в памяти процесса (в отличие от дискового EmbeddingCache)
+        self._hot: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        # Незавершенные кодирования по ключу текста: одновременные запросы
+        # одного текста ждут общий расчет вместо повторного прохода модели
+        self._inflight: Dict[int, asyncio.Future] = {}
+        # Один поток на модель: параллельные прогоны одной модели на CPU
+        # не ускоряются и не потокобезопасны
+        self._encode_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='embeddings')
 
         self.use_qdrant = use_qdrant
         self.qdrant = None
         self.documents_loaded = False
         
+        # Локальный индекс: документы и матрица их нормированных эмбеддингов (N, D)
+        self.documents: Sequence[str] = []
+        # Документы не из KnowledgeBase хранятся object-массивом для выборки по индексам
+        self._docs_arr = np.empty(0, dtype=object)
+        self.doc_embeddings = np.empty((0, 0), dtype=np.float32)
+        # Буфер под оценки близости, переиспользуется между запросами
+        self._scores_buf = np.empty(0, dtype=np.float32)
+        
+        # int8-режим: матрица хранится квантованной с масштабом на строку (в 4 раза меньше памяти)
+        self.int8 = int8
+        self.doc_i8 = np.empty((0, 0), dtype=np.int8)
+        self.doc_scales = np.empty(0, dtype=np.float32)
+        
+        # Инициализация Qdrant и загрузка документов откладываются до первого
+        # асинхронного вызова: конструктору не нужен работающий event loop
+        self._init_task: Optional[asyncio.Task] = None
+        self._load_task: Optional[asyncio.Task] = None
+        self._pending_documents: Optional[Sequence[str]] = None
+        # Построение локального индекса: загрузка в Qdrant берет из него готовые векторы
+        self._index_future: Optional[asyncio.Future] = None
+        
         if use_qdrant:
             self.qdrant = QdrantManager()
-            asyncio.create_task(self._initialize_qdrant())
+
+    @property
+    def model(self) -> SentenceTransformer:
+        """Модель эмбеддингов (ленивая загрузка, потокобезопасна)"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    try:
+                        with suppress_stdout():
+                            self._model = SentenceTransformer(self.model_name)
+                        logger.info(f"Модель эмбеддингов {self.model_name} успешно загружена")
+                    except Exception as e:
+                        logger.error(f"Ошибка инициализации модели эмбеддингов: {e}")
+                        raise RuntimeError(f"Не удалось инициализировать модель эмбеддингов: {e}")
+        return self._model
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        return self.model.encode([text])
 
     async def _initialize_qdrant(self):
         try:
-            await self.qdrant.initialize(self.model)
+            # Загрузка модели не должна блокировать event loop
+            model = await asyncio.get_running_loop().run_in_executor(self._encode_pool, lambda: self.model)
+            # Qdrant кодирует в том же потоке, что и менеджер: прогоны модели не пересекаются
+            await self.qdrant.initialize(model, executor=self._encode_pool)
             logger.info("Qdrant успешно инициализирован")
         except Exception as e:
             logger.error(f"Ошибка инициализации Qdrant: {e}")
             self.use_qdrant = False
 
-    async def load_documents_to_qdrant(self, documents: List[str]) -> bool:
+    def _start_qdrant(self) -> Optional[asyncio.Task]:
+        """Запуск фоновой инициализации Qdrant и отложенной загрузки документов"""
+        if not self.use_qdrant or not self.qdrant:
+            return None
+        
+        if self._init_task is None:
+            self._init_task = asyncio.ensure_future(self._initialize_qdrant())
+        if self._pending_documents is not None:
+            documents, self._pending_documents = self._pending_documents, None
+            self._load_task = asyncio.ensure_future(self._load_after_init(documents))
+        return self._init_task
+
+    async def _ensure_initialized(self) -> None:
+        """Дождаться инициализации Qdrant (ожидающий может быть отменен без отмены самой инициализации)"""
+        task = self._start_qdrant()
+        if task is not None:
+            await asyncio.shield(task)
+
+    async def _load_after_init(self, documents: Sequence[str]) -> bool:
+        await asyncio.shield(self._init_task)
+        
+        # Документы уже закодированы для локального индекса: второй проход
+        # модели по всей базе знаний не нужен
+        if self._index_future is not None:
+            try:
+                await asyncio.shield(self._index_future)
+            except Exception:
+                pass
+        embeddings = None
+        if self.documents is documents and len(self.doc_embeddings) == len(documents):
+            embeddings = self.doc_embeddings
+        return await self.load_documents_to_qdrant(documents, embeddings)
+
+    async def load_documents_to_qdrant(self, documents: List[str],
+                                       embeddings: Optional[np.ndarray] = None) -> bool:
         if not self.use_qdrant or not self.qdrant:
             logger.warning("Qdrant недоступен, используем fallback")
             return False
             
         try:
-            success = await self.qdrant.add_documents(documents)
+            success = await self.qdrant.add_documents(documents, embeddings=embeddings)
             if success:
                 self.documents_loaded = True
                 logger.info(f"Документы загружены в Qdrant: {len(documents)}")
@@ -56,13 +148,38 @@ class EmbeddingsManager:
             logger.error(f"Ошибка загрузки документов в Qdrant: {e}")
             return False
 
+    @staticmethod
+    def _text_key(text: str) -> int:
+        return text_key(text)
+
     async def get_embedding(self, text: str) -> np.ndarray:
-        if not self.model:
-            raise RuntimeError("Модель эмбеддингов не инициализирована")
+        embedding, _ = await self.get_embedding_with_hit(text)
+        return embedding
+
+    async def get_embedding_with_hit(self, text: str) -> Tuple[np.ndarray, bool]:
+        """Эмбеддинг текста и признак попадания в горячий кэш"""
+        key = self._text_key(text)
+        embedding = self._hot.get(key)
+        if embedding is not None:
+            self._hot.move_to_end(key)
+            return embedding, True
+        
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._encode_text(text))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Отмена одного из ожидающих не должна отменять общий расчет
+        embedding = await asyncio.shield(task)
+        self._hot[key] = embedding
+        if len(self._hot) > self.HOT_CACHE_SIZE:
+            self._hot.popitem(last=False)
+        return embedding, False
+
+    async def _encode_text(self, text: str) -> np.ndarray:
         try:
             loop = asyncio.get_running_loop()
             with suppress_stdout():
-                embedding = await loop.run_in_executor(None, self.model.encode, [text])
+                embedding = await loop.run_in_executor(self._encode_pool, self._encode_one, text)
             return embedding[0]
         except Exception as e:
             logger.error(f"Ошибка получения эмбеддинга: {e}")
@@ -70,12 +187,21 @@ class EmbeddingsManager:
 
     async def find_similar(self, 
                          question: str, 
+                         question_embedding: Optional[np.ndarray] = None,
                          top_k: int = 5,
                          score_threshold: float = 0.3) -> List[str]:
+        self._start_qdrant()
+        
+        # Локальная матрица в памяти: одно умножение вместо похода в Qdrant
+        # и повторного кодирования вопроса на его стороне
+        if question_embedding is not None and (len(self.doc_embeddings) or len(self.doc_i8)):
+            return self._search_local(question_embedding, top_k, score_threshold)
+
         if self.use_qdrant and self.qdrant and self.documents_loaded:
             try:
                 results = await self.qdrant.search_similar(
-                    question, top_k=top_k, score_threshold=score_threshold
+                    question, top_k=top_k, score_threshold=score_threshold,
+                    query_embedding=question_embedding
                 )
                 
                 if results:
@@ -86,20 +212,97 @@ class EmbeddingsManager:
                 logger.error(f"Ошибка поиска в Qdrant: {e}")
         
         logger.warning("Используем fallback поиск")
-        if hasattr(self, 'documents') and self.documents:
+        if self.documents:
             return self.documents[:top_k]
         else:
             return ["Информация по вашему запросу не найдена в базе знаний."]
 
-    def precompute_embeddings(self, documents: List[str], cache=None) -> np.ndarray:
-        self.documents = documents
+    def _search_local(self, question_embedding: np.ndarray, top_k: int, score_threshold: float) -> List[str]:
+        """Косинусный поиск по локальной матрице эмбеддингов одним умножением"""
+        query = np.asarray(question_embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        
+        if self.int8:
+            scores = embeddings_kernels.int8_scores(self.doc_i8, self.doc_scales, query, self._scores_buf)
+        else:
+            scores = embeddings_kernels.cosine_scores(self.doc_embeddings, query, self._scores_buf)
+        k = min(top_k, len(scores))
+        if self.ARGPARTITION_MIN_DOCS <= len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)[:k]
+        top = top[scores[top] >= score_threshold]
         
+        return self._take_documents(top)
+
+    def _take_documents(self, indices: np.ndarray) -> List[str]:
+        """Документы по индексам одной выборкой"""
+        if isinstance(self.documents, KnowledgeBase):
+            return self.documents.take(indices)
+        return self._docs_arr[indices].tolist()
+
+    def precompute_embeddings(self, documents: Sequence[str], cache=None) -> np.ndarray:
+        """Предварительный расчет эмбеддингов документов
+        
+        Эмбеддинги хранятся одной непрерывной float32-матрицей (N, D) с
+        L2-нормированными строками: близость ко всем документам считается
+        одним вызовом BLAS.
+        """
         if self.use_qdrant and documents:
-            asyncio.create_task(self.load_documents_to_qdrant(documents))
+            self._pending_documents = documents
+        
+        return self._build_index(documents, cache)
+
+    async def precompute_embeddings_async(self, documents: Sequence[str], cache=None) -> np.ndarray:
+        """То же, что precompute_embeddings, но модель и матрица готовятся в пуле потоков"""
+        if self.use_qdrant and documents:
+            self._pending_documents = documents
+        
+        loop = asyncio.get_running_loop()
+        self._index_future = loop.run_in_executor(self._encode_pool, self._build_index, documents, cache)
+        self._start_qdrant()
+        return await self._index_future
+
+    def _build_index(self, documents: Sequence[str], cache=None) -> np.ndarray:
+        """Построение локального индекса (без обращений к event loop)"""
+        self.documents = documents
+        if not isinstance(documents, KnowledgeBase):
+            self._docs_arr = np.empty(len(documents), dtype=object)
+            self._docs_arr[:] = list(documents)
+        
+        if not documents:
+            self.doc_embeddings = np.empty((0, 0), dtype=np.float32)
+            self.doc_i8 = np.empty((0, 0), dtype=np.int8)
+            self.doc_scales = np.empty(0, dtype=np.float32)
+            return self.doc_embeddings
+        
+        if cache is not None:
+            vectors = cache.get_embeddings(documents, self.model)
+        else:
+            with suppress_stdout():
+                vectors = self.model.encode(list(documents))
+        
+        matrix = np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        
+        if self.int8:
+            # float32-копия не хранится: поиск идет только по квантованной матрице
+            self.doc_i8, self.doc_scales = embeddings_kernels.quantize_int8(matrix)
+            self.doc_embeddings = np.empty((0, matrix.shape[1]), dtype=np.float32)
+            self._scores_buf = np.empty(len(matrix), dtype=np.float32)
+            return self.doc_i8
         
-        return np.array([])
+        self.doc_embeddings = matrix
+        self._scores_buf = np.empty(len(matrix), dtype=np.float32)
+        embeddings_kernels.warmup(matrix.shape[1])
+        return matrix
 
     async def get_qdrant_status(self) -> Dict[str, Any]:
+        await self._ensure_initialized()
         if not self.use_qdrant or not self.qdrant:
             return {"status": "disabled"}
             
@@ -2,6 +2,8 @@
 import logging
 from typing import Dict, Any, Optional, AsyncGenerator
 import asyncio
+import bisect
+import re
 import time
 
 from .ai_assistant import SmartDeepThinkRAG
@@ -17,9 +19,61 @@ except ImportError as e:
 
 logger = logging.getLogger(__name__)
 
+# Заголовки ответов в верхнем регистре вычисляются один раз
+_CURRENCY_HEADER = "💱 Курсы валют ЦБ РФ:\n\n".upper()
+_SUMMARY_HEADER = "Финансовая сводка:\n\n".upper()
+_INDICES_HEADER = "ОСНОВНЫЕ ИНДЕКСЫ:\n"
+
+# Ключевые слова маршрутизации по категориям в порядке приоритета
+_ROUTE_KEYWORDS = (
+    ('rate', ('ставк', 'ключев', 'цб', 'центробанк', 'процент')),
+    ('stock', ('акци', 'тикер', 'котировк', 'цена акци')),
+    ('currency', ('курс', 'валют', 'доллар', 'евро', 'usd', 'eur')),
+    ('market', ('биржа', 'рынок', 'индекс', 'сводк', 'мосбирж', 'финанс')),
+    ('company', ('сбербанк', 'газпром', 'лукойл', 'втб', 'роснефть')),
+)
+_ROUTE_PRIORITY = {name: i for i, (name, _) in enumerate(_ROUTE_KEYWORDS)}
+
+# Тикеры и ключевые слова для их поиска, в порядке приоритета
+_STOCK_KEYWORDS = (
+    ('SBER', ('sber', 'сбер', 'сбербанк')),
+    ('GAZP', ('gazp', 'газпром')),
+    ('LKOH', ('lkoh', 'лукойл')),
+    ('VTBR', ('vtbr', 'втб')),
+    ('ROSN', ('rosn', 'роснефть')),
+)
+_COMPANY_NAMES = dict(zip(('SBER', 'GAZP', 'LKOH', 'VTBR', 'ROSN'), _ROUTE_KEYWORDS[-1][1]))
+_SYMBOL_PRIORITY = {symbol: i for i, (symbol, _) in enumerate(_STOCK_KEYWORDS)}
+
+def _lookahead_pattern(groups) -> 're.Pattern':
+    """Одно регулярное выражение с именованной группой на категорию
+
+    Опережающая проверка не поглощает символы, поэтому за один проход
+    находятся и перекрывающиеся вхождения ключевых слов разных категорий.
+    """
+    return re.compile('(?=' + '|'.join(
+        f"(?P<{name}>{'|'.join(map(re.escape, words))})" for name, words in groups
+    ) + ')')
+
+_ROUTE_RE = _lookahead_pattern(_ROUTE_KEYWORDS)
+_STOCK_SYMBOL_RE = _lookahead_pattern(_STOCK_KEYWORDS)
+_COMPANY_SYMBOL_RE = _lookahead_pattern((s, (name,)) for s, name in _COMPANY_NAMES.items())
+
+def _first_by_priority(pattern: 're.Pattern', text: str, priority: Dict[str, int]) -> Optional[str]:
+    """Найденная в тексте группа с наивысшим приоритетом"""
+    return min({m.lastgroup for m in pattern.finditer(text)}, key=priority.__getitem__, default=None)
+
+def _arrow_and_sign(change: float) -> tuple:
+    """Иконка направления и знак для вывода изменения"""
+    return ("📈", "+") if change >= 0 else ("📉", "")
+
 class FinancialAssistant(SmartDeepThinkRAG):
     """Расширенный ассистент с финансовыми данными"""
     
+    # Пороги сокращения чисел и соответствующие делители с суффиксами
+    _SCALE_THRESHOLDS = (1_000, 1_000_000, 1_000_000_000)
+    _SCALES = ((1_000, " тыс"), (1_000_000, " млн"), (1_000_000_000, " млрд"))
+    
     def __init__(self, config_path: str = "config.json"):
         super().__init__(config_path)
         
@@ -70,43 +124,34 @@ class FinancialAssistant(SmartDeepThinkRAG):
             return None  # Пусть базовый RAG обработает
         
         question_lower = question.lower()
+        # Категория определяется одним проходом по вопросу
+        category = _first_by_priority(_ROUTE_RE, question_lower, _ROUTE_PRIORITY)
         
         try:
-            if any(word in question_lower for word in ['ставк', 'ключев', 'цб', 'центробанк', 'процент']):
+            if category == 'rate':
                 data = await self.financial_parser.get_market_summary()
                 
                 if 'key_rate' in data and data['key_rate'] and 'error' not in data['key_rate']:
                     rate_info = data['key_rate']
                     rate = rate_info.get('rate', 'N/A')
                     
-                    response = f"Ключевая ставка ЦБ РФ: {rate}%".upper()
+                    parts = [f"Ключевая ставка ЦБ РФ: {rate}%"]
                     
                     # Добавляем дополнительную информацию
                     if 'date' in rate_info:
-                        response += f"\nДата: {rate_info['date']}".upper()
+                        parts.append(f"\nДата: {rate_info['date']}")
                     if 'next_meeting' in rate_info:
-                        response += f"\nСледующее заседание: {rate_info['next_meeting']}".upper()
+                        parts.append(f"\nСледующее заседание: {rate_info['next_meeting']}")
                     if 'note' in rate_info:
-                        response += f"\n{rate_info['note']}".upper()
+                        parts.append(f"\n{rate_info['note']}")
                     
-                    return response
+                    # Весь ответ в верхнем регистре: один вызов upper() на готовой строке
+                    return "".join(parts).upper()
                 else:
                     return "Не удалось получить актуальные данные о ключевой ставке ЦБ"
             
-            elif any(word in question_lower for word in ['акци', 'тикер', 'котировк', 'цена акци']):
-                symbols = {
-                    'sber': 'SBER', 'сбер': 'SBER', 'сбербанк': 'SBER',
-                    'gazp': 'GAZP', 'газпром': 'GAZP', 
-                    'lkoh': 'LKOH', 'лукойл': 'LKOH',
-                    'vtbr': 'VTBR', 'втб': 'VTBR',
-                    'rosn': 'ROSN', 'роснефть': 'ROSN'
-                }
-                
-                symbol_found = None
-                for keyword, symbol in symbols.items():
-                    if keyword in question_lower:
-                        symbol_found = symbol
-                        break
+            elif category == 'stock':
+                symbol_found = _first_by_priority(_STOCK_SYMBOL_RE, question_lower, _SYMBOL_PRIORITY)
                 
                 if not symbol_found:
                     symbol_found = 'SBER'  # По умолчанию
@@ -114,24 +159,18 @@ class FinancialAssistant(SmartDeepThinkRAG):
                 data = await self.financial_parser.get_stock_price(symbol_found)
                 return self._format_stock_response(data)
             
-            elif any(word in question_lower for word in ['курс', 'валют', 'доллар', 'евро', 'usd', 'eur']):
+            elif category == 'currency':
                 data = await self.financial_parser.get_currency_rates()
                 return self._format_currency_response(data)
             
-            elif any(word in question_lower for word in ['биржа', 'рынок', 'индекс', 'сводк', 'мосбирж', 'финанс']):
+            elif category == 'market':
                 data = await self.financial_parser.get_market_summary()
                 return self._format_market_summary(data)
             
-            elif any(word in question_lower for word in ['сбербанк', 'газпром', 'лукойл', 'втб', 'роснефть']):
-                symbols = {
-                    'сбербанк': 'SBER', 'газпром': 'GAZP', 'лукойл': 'LKOH',
-                    'втб': 'VTBR', 'роснефть': 'ROSN'
-                }
-                
-                for name, symbol in symbols.items():
-                    if name in question_lower:
-                        data = await self.financial_parser.get_stock_price(symbol)
-                        return self._format_stock_response(data)
+            elif category == 'company':
+                symbol = _first_by_priority(_COMPANY_SYMBOL_RE, question_lower, _SYMBOL_PRIORITY)
+                data = await self.financial_parser.get_stock_price(symbol)
+                return self._format_stock_response(data)
                         
         except Exception as e:
             logger.error(f"Ошибка обработки финансового запроса: {e}")
@@ -146,8 +185,7 @@ class FinancialAssistant(SmartDeepThinkRAG):
         
         change = data.get('change', 0)
         change_percent = data.get('change_percent', 0)
-        change_icon = "📈" if change >= 0 else "📉"
-        change_color = "+" if change >= 0 else ""
+        change_icon, change_color = _arrow_and_sign(change)
         
         response = f"""
 {change_icon} **{data.get('name', data['symbol'])}** ({data['symbol']})
@@ -164,82 +202,79 @@ class FinancialAssistant(SmartDeepThinkRAG):
         if 'error' in data:
             return f"{data['error']}"
         
-        response = "💱 Курсы валют ЦБ РФ:\n\n".upper()
+        parts = [_CURRENCY_HEADER]
         
-        main_currencies = ['USD', 'EUR', 'CNY']
+        main_currencies = ('USD', 'EUR', 'CNY')
         found_currencies = 0
         
         for currency in main_currencies:
             if currency in data and 'error' not in data[currency]:
                 info = data[currency]
                 change = info.get('change', 0)
-                change_icon = "📈" if change >= 0 else "📉"
-                change_color = "+" if change >= 0 else ""
+                change_icon, change_color = _arrow_and_sign(change)
                 
-                response += f"{change_icon} **{info['name']}:** {info['value']} руб. "
+                parts.append(f"{change_icon} **{info['name']}:** {info['value']} руб. ")
                 if change != 0:
-                    response += f"({change_color}{change:.2f}, {change_color}{info.get('change_percent', 0):.2f}%)\n"
+                    parts.append(f"({change_color}{change:.2f}, {change_color}{info.get('change_percent', 0):.2f}%)\n")
                 else:
-                    response += "\n"
+                    parts.append("\n")
                 found_currencies += 1
         
         if found_currencies == 0:
             return "Не удалось получить данные о курсах валют"
         
-        return response
+        return "".join(parts)
     
     def _format_market_summary(self, data: Dict) -> str:
         """Форматирование сводки рынка"""
         if 'error' in data:
             return f"{data['error']}"
         
-        response = "Финансовая сводка:\n\n".upper()
+        parts = [_SUMMARY_HEADER]
         
         # Ключевая ставка
         if data.get('key_rate') and 'error' not in data['key_rate']:
             rate_info = data['key_rate']
-            response += f"Ключевая ставка ЦБ: {rate_info.get('rate', 'N/A')}%\n\n"
+            parts.append(f"Ключевая ставка ЦБ: {rate_info.get('rate', 'N/A')}%\n\n")
         
         # Индексы
         if data.get('indices'):
             indices_data = data['indices']
-            response += "ОСНОВНЫЕ ИНДЕКСЫ:\n".upper()
+            parts.append(_INDICES_HEADER)
             
-            for index_key in ['IMOEX', 'RTSI']:
+            for index_key in ('IMOEX', 'RTSI'):
                 if index_key in indices_data and 'error' not in indices_data[index_key]:
                     info = indices_data[index_key]
                     change = info.get('change', 0)
-                    change_icon = "📈" if change >= 0 else "📉"
-                    change_color = "+" if change >= 0 else ""
+                    change_icon, change_color = _arrow_and_sign(change)
                     
-                    response += f"  {change_icon} {info.get('name', index_key)}: {info.get('value', 'N/A')} "
+                    parts.append(f"  {change_icon} {info.get('name', index_key)}: {info.get('value', 'N/A')} ")
                     if change != 0:
-                        response += f"({change_color}{change:.2f})\n"
+                        parts.append(f"({change_color}{change:.2f})\n")
                     else:
-                        response += "\n"
+                        parts.append("\n")
         
         # Курсы валют
         if data.get('currencies'):
             currencies_data = data['currencies']
             if 'error' not in currencies_data:
-                response += "\n💱 **Курсы валют:**\n"
+                parts.append("\n💱 **Курсы валют:**\n")
                 
-                for currency in ['USD', 'EUR']:
+                for currency in ('USD', 'EUR'):
                     if currency in currencies_data and 'error' not in currencies_data[currency]:
                         info = currencies_data[currency]
-                        response += f"  🇺🇸 {currency}: {info.get('value', 'N/A')} руб.\n"
+                        parts.append(f"  🇺🇸 {currency}: {info.get('value', 'N/A')} руб.\n")
         
-        return response
+        return "".join(parts)
     
     def _format_number(self, number: float) -> str:
         """Форматирование больших чисел"""
-        if number >= 1_000_000_000:
-            return f"{number/1_000_000_000:.1f} млрд"
-        elif number >= 1_000_000:
-            return f"{number/1_000_000:.1f} млн"
-        elif number >= 1_000:
-            return f"{number/1_000:.1f} тыс"
-        return str(number)
+        idx = bisect.bisect_right(self._SCALE_THRESHOLDS, number)
+        # NaN ложно сравнивается с любым порогом, и bisect отнес бы его к последнему
+        if not idx or number != number:
+            return str(number)
+        divisor, suffix = self._SCALES[idx - 1]
+        return f"{number/divisor:.1f}{suffix}"
     
     async def ask_streaming_wrapper(self, question: str) -> None:
         """Обертка для стримингового вывода"""
@@ -0,0 +1,114 @@
+"""База знаний с ленивым чтением документов из файла"""
+from collections.abc import Sequence
+from typing import List, Union
+import logging
+import mmap
+import operator
+import os
+import weakref
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Байты, по которым строка заведомо непуста после str.strip(). Исключены
+# ASCII-пробельные символы (включая \x1c-\x1f, их тоже удаляет str.strip),
+# продолжения UTF-8 и ведущие байты C2/E1/E2/E3, с которых начинаются
+# пробельные символы Unicode (U+0085, U+00A0, U+1680, U+2000-U+205F, U+3000)
+_SOLID = np.ones(256, dtype=bool)
+_SOLID[list(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')] = False
+_SOLID[0x80:0xC0] = False
+_SOLID[[0xC2, 0xE1, 0xE2, 0xE3]] = False
+
+def _close_mapping(mm) -> None:
+    if isinstance(mm, mmap.mmap):
+        mm.close()
+
+class KnowledgeBase(Sequence):
+    """Документы базы знаний, отображенные в память через mmap
+
+    При открытии строится только индекс смещений непустых строк,
+    сами документы декодируются при обращении по индексу.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # mmap не умеет отображать пустые файлы
+                self._mm = b''
+
+        self._starts, self._ends = self._index_lines(self._mm)
+        # База знаний общая для экземпляров ассистента (кэш в ai_assistant),
+        # поэтому отображение закрывается при сборке объекта или при выходе
+        # из интерпретатора, а не при закрытии отдельного ассистента
+        self._finalizer = weakref.finalize(self, _close_mapping, self._mm)
+
+    @staticmethod
+    def _index_lines(buf) -> tuple:
+        """Построение индекса смещений непустых строк
+
+        Границы строк как у текстового режима open(): \\n, \\r\\n и одиночный \\r
+        (\\r перед \\n остается в строке и удаляется strip при чтении).
+        """
+        data = np.frombuffer(buf, dtype=np.uint8)
+        breaks = np.flatnonzero(data == 0x0A)
+        cr = np.flatnonzero(data == 0x0D)
+        if len(cr):
+            nxt = cr + 1
+            lone = nxt >= len(data)
+            lone[~lone] = data[nxt[~lone]] != 0x0A
+            breaks = np.union1d(breaks, cr[lone])
+        starts = np.concatenate(([0], breaks + 1)).astype(np.int64)
+        ends = np.concatenate((breaks, [len(data)])).astype(np.int64)
+
+        # Строка непуста, если в ней есть заведомо непробельный байт. Отрезки
+        # reduceat включают и разделитель строки, он пробельный; sentinel в конце
+        # покрывает последнюю пустую строку файла
+        solid = np.empty(len(data) + 1, dtype=bool)
+        np.take(_SOLID, data, out=solid[:-1])
+        solid[-1] = False
+        keep = np.logical_or.reduceat(solid, starts)
+        del solid, data
+
+        # Строки из одних пробельных байтов и возможных пробелов Unicode
+        # (редкость) проверяются декодированием
+        for i in np.flatnonzero(~keep & (ends > starts)).tolist():
+            keep[i] = bool(bytes(buf[starts[i]:ends[i]]).decode('utf-8').strip())
+        return starts[keep], ends[keep]
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        index = operator.index(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Индекс документа вне диапазона")
+
+        return self._mm[self._starts[index]:self._ends[index]].decode('utf-8').strip()
+
+    def take(self, indices) -> List[str]:
+        """Выборка документов по массиву индексов через векторизованный сбор смещений"""
+        indices = np.asarray(indices, dtype=np.int64)
+        mm = self._mm
+        return [
+            mm[s:e].decode('utf-8').strip()
+            for s, e in zip(self._starts[indices].tolist(), self._ends[indices].tolist())
+        ]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Длины документов в байтах"""
+        return self._ends - self._starts
+
+    def close(self) -> None:
+        """Освобождение отображения файла"""
+        self._finalizer()
@@ -1,46 +1,369 @@
-from typing import List, Optional, AsyncGenerator
+from typing import Dict, List, Optional, AsyncGenerator
 import aiohttp
+import functools
 import json
 import logging
+import random
 import re
 import asyncio
+import time
 from contextlib import asynccontextmanager
 
+# orjson необязателен: без него используется стандартный json.
+# Обе функции принимают bytes, а orjson.JSONDecodeError наследует json.JSONDecodeError
+try:
+    import orjson
+    _json_loads = orjson.loads
+    # aiohttp ждет от json_serialize строку
+    _json_dumps = lambda obj: orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+# Hyperscan необязателен: без него используется стандартный re
+try:
+    import hyperscan
+    HYPERSCAN_AVAILABLE = True
+except ImportError:
+    HYPERSCAN_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# Инвестиционный вопрос получает промпт финансового консультанта
+_INVEST_PROMPT_RE = re.compile(r"акции|инвестиц|вложить|выгодн|портфель", re.IGNORECASE)
+
+# Намерения для промпта deep think. Опережающая проверка не поглощает символы,
+# поэтому за один проход находятся и перекрывающиеся ключевые слова
+_ANALYZE_INTENT_RE = re.compile(
+    r"(?=(?P<definition>что такое|определ|означает)"
+    r"|(?P<process>как|процесс|оформить)"
+    r"|(?P<documents>документ|нужно|требуется)"
+    r"|(?P<cost>ставк|процент|сколько стоит)"
+    r"|(?P<invest>акции|инвестиц|вложить))",
+    re.IGNORECASE
+)
+# Порядок групп задает приоритет намерения при нескольких совпадениях
+_ANALYZE_INTENT_LABELS = {
+    'definition': "получить определение понятия",
+    'process': "узнать процесс оформления",
+    'documents': "узнать необходимые документы",
+    'cost': "узнать стоимость или ставки",
+    'invest': "получить инвестиционные рекомендации",
+}
+_ANALYZE_INTENT_PRIORITY = {name: i for i, name in enumerate(_ANALYZE_INTENT_LABELS)}
+
+@functools.lru_cache(maxsize=1024)
+def _analyze_intent_text(question: str) -> str:
+    groups = {m.lastgroup for m in _ANALYZE_INTENT_RE.finditer(question)}
+    if not groups:
+        return "общий информационный запрос"
+    return _ANALYZE_INTENT_LABELS[min(groups, key=_ANALYZE_INTENT_PRIORITY.__getitem__)]
+
+# Формальные обороты, убираемые в простом режиме
+_SIMPLIFY_PHRASES = (
+    "Конечно,",
+    "Рад помочь!",
+    "Вот ответ на ваш вопрос:",
+    "Согласно предоставленной информации,",
+)
+_SIMPLIFY_RE = re.compile('|'.join(map(re.escape, _SIMPLIFY_PHRASES)))
+# Первые буквы оборотов: текст без них не может содержать ни одного
+_SIMPLIFY_FIRST_CHARS = frozenset(phrase[0] for phrase in _SIMPLIFY_PHRASES)
+# Сколько последних символов потока придерживать: оборот может прийти частями
+_SIMPLIFY_HOLD = max(map(len, _SIMPLIFY_PHRASES)) - 1
+
+# Шаблон в нижнем регистре: текст приводится к нему один раз, без IGNORECASE
+_CODE_PATTERN = r'\b(sql|select|insert|update|delete|drop|create table|execute|eval|exec)\b|написать код|сгенерируй sql'
+# Короче самого короткого ключевого слова ('sql') текст совпасть не может
+_CODE_MIN_LEN = 3
+
+async def _iter_lines(content: aiohttp.StreamReader) -> AsyncGenerator[bytes, None]:
+    """Строки тела ответа: чтение блоками по мере поступления и разбиение по \\n
+
+    Один блок обычно содержит несколько JSON-записей, поэтому ожиданий
+    чтения меньше, чем при построчной итерации по response.content.
+    """
+    buf = bytearray()
+    async for chunk, _ in content.iter_chunks():
+        buf += chunk
+        start = 0
+        while (end := buf.find(b'\n', start)) != -1:
+            yield bytes(buf[start:end])
+            start = end + 1
+        del buf[:start]
+    if buf:
+        yield bytes(buf)
+
 class LLMError(Exception):
     """Ошибки при работе с LLM"""
     pass
 
+# Шаблоны промптов по режимам (str.format_map: подставляемые значения не разбираются)
+_PROMPT_TEMPLATES = {
+    # Инвестиционный вопрос
+    'invest': """Ты - финансовый консультант. Дай конкретные рекомендации по инвестициям в акции.
+
+    ВОПРОС КЛИЕНТА: {question}
+
+    БАЗА ЗНАНИЙ ОБ АКЦИЯХ:
+    {context}
+
+    ИНСТРУКЦИИ:
+    - Дай конкретные рекомендации по акциям
+    - Объясни почему именно эти акции
+    - Учитывай риск и потенциальную доходность
+    - Предложи диверсификацию портфеля
+    - Будь конкретен и практичен
+
+    ОТВЕТ:""",
+    # Режим -deepthink
+    'deep_think': """ПРОЦЕСС МЫШЛЕНИЯ:
+
+    1. АНАЛИЗ ЗАПРОСА:
+    - Вопрос пользователя: "{question}"
+    - Возможное намерение: {intent}
+    - Соответствие политике безопасности: {policy}
+
+    2. ИНФОРМАЦИЯ ДЛЯ ОТВЕТА:
+    {context}
+
+    3. ЛОГИЧЕСКИЙ АНАЛИЗ:
+    - Какая информация наиболее релевантна?
+    - Что именно спрашивает пользователь?
+    - Какие детали важны для полного ответа?
+
+    4. ФОРМИРОВАНИЕ ОТВЕТА:
+    - Структурировать информацию логически
+    - Выделить ключевые моменты
+    - Дать практические рекомендации
+
+    ОТВЕТ:""",
+    # Простой режим
+    'simple': "Вопрос: {question}\nДанные: {context}\nКраткий ответ:",
+    # Обычный режим
+    'default': """Ответь на вопрос: {question}
+
+    Информация для ответа:
+    {context}
+
+    Ответ:""",
+}
+
+@functools.lru_cache(maxsize=256)
+def _render_prompt(template: str, question: str, context_docs: tuple,
+                   intent: Optional[str], policy: Optional[str]) -> str:
+    """Сборка промпта; повторный вопрос с тем же контекстом берется из кэша
+
+    Ключ - кортеж документов: хэши строк считаются в C и кэшируются в самих
+    строках, объединенный контекст строится только при промахе.
+    """
+    return template.format_map({
+        'question': question,
+        'context': "\n".join(context_docs) if context_docs else "Информация не найдена",
+        'intent': intent,
+        'policy': policy,
+    })
+
+class _CircuitBreaker:
+    """Предохранитель для бэкенда: CLOSED -> OPEN -> HALF_OPEN -> CLOSED
+
+    После FAILURE_THRESHOLD сбоев подряд запросы отклоняются сразу, без
+    попыток соединения. Через RECOVERY_SECS пропускается один пробный
+    запрос: успех замыкает цепь, сбой снова размыкает ее.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    FAILURE_THRESHOLD = 5
+    RECOVERY_SECS = 30.0
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос; при истечении паузы пропускает пробный"""
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.RECOVERY_SECS:
+            return False
+        # Следующий пробный запрос не раньше, чем через RECOVERY_SECS
+        self.state = self.HALF_OPEN
+        self.opened_at = now
+        return True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.FAILURE_THRESHOLD:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
 class LLMAdapter:
     """Адаптер для работы с языковой моделью через Ollama API"""
     
+    # Ограничения контекста в промпте: каждый лишний токен - время генерации
+    MAX_CTX_DOCS = 5
+    MAX_DOC_CHARS = 800
+    MAX_TOTAL_CHARS = 3500
+    
+    # Шаблоны промптов; наследник может заменить таблицу или переопределить _prompt_kind
+    PROMPT_TEMPLATES = _PROMPT_TEMPLATES
+    
+    # Предохранители по base_url: общие для всех адаптеров одного сервера
+    _breakers: Dict[str, _CircuitBreaker] = {}
+    
+    # Повторы запросов к Ollama: экспоненциальная задержка с полным джиттером
+    MAX_RETRIES = 2
+    RETRY_BASE_DELAY = 0.5
+    RETRY_MAX_DELAY = 8.0
+    # Бюджет повторов на адаптер (token bucket): не более RETRY_BUDGET подряд,
+    # затем RETRY_BUDGET_REFILL повторов в секунду, чтобы сбой не умножал нагрузку
+    RETRY_BUDGET = 10
+    RETRY_BUDGET_REFILL = 0.5
+    # Таймауты на соединение и на паузу между пакетами данных; общий срок
+    # запроса со всеми повторами задает timeout адаптера
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 30
+    # Bulkhead: одновременных потоков к Ollama и ожидающих свободного слота
+    MAX_CONCURRENT_REQUESTS = 4
+    MAX_QUEUED_REQUESTS = 16
+    
     def __init__(self, model_name: str = "qwen2.5:0.5b", base_url: str = "http://localhost:11434", timeout: int = 120):
         self.model_name = model_name
         self.base_url = base_url
         self.timeout = timeout
+        # Неизменная часть тела запроса к /api/generate собирается один раз
+        self._base_payload = {
+            "model": model_name,
+            "stream": True,
+            "options": {
+                "temperature": 0.1,
+                "top_p": 0.9,
+                "num_predict": 600,
+                "repeat_penalty": 1.2
+            }
+        }
+        # Одна сессия на все время жизни адаптера: соединения с Ollama
+        # переиспользуются (keep-alive) вместо нового TCP-подключения на запрос
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._retry_tokens = float(self.RETRY_BUDGET)
+        self._breaker = self._breakers.setdefault(base_url, _CircuitBreaker())
+        self._bulkhead = asyncio.Semaphore(self.MAX_CONCURRENT_REQUESTS)
+        self._queued = 0
+        self._retry_refilled_at = time.monotonic()
         
         # Шаблоны для определения запросов на генерацию кода/SQL
-        self._code_patterns = re.compile(
-            r'\b(sql|select|insert|update|delete|drop|create table|execute|eval|exec)\b|написать код|сгенерируй sql',
-            flags=re.IGNORECASE
-        )
+        self._code_patterns = re.compile(_CODE_PATTERN)
+        
+        # База Hyperscan (DFA) компилируется один раз вместе со scratch-памятью
+        self._hs_db = None
+        self._hs_scratch = None
+        if HYPERSCAN_AVAILABLE:
+            try:
+                self._hs_db = hyperscan.Database()
+                self._hs_db.compile(
+                    expressions=[_CODE_PATTERN.encode('utf-8')],
+                    flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8
+                           | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_SINGLEMATCH]
+                )
+                self._hs_scratch = hyperscan.Scratch(self._hs_db)
+            except Exception as e:
+                logger.warning(f"Hyperscan недоступен, используется re: {e}")
+                self._hs_db = None
+        
+        # Пользователи часто повторяют вопросы: результат проверки кэшируется
+        self._code_request_cache = functools.lru_cache(maxsize=512)(self._scan_code_request)
 
     def _is_code_request(self, text: str) -> bool:
-        """Проверка, является ли запрос запросом на генерацию кода"""
-        if not text:
+        """Проверка, является ли запрос запросом на генерацию кода (с кэшем по тексту)"""
+        return self._code_request_cache(text)
+
+    def _scan_code_request(self, text: str) -> bool:
+        if not text or len(text) < _CODE_MIN_LEN:
             return False
-        return bool(self._code_patterns.search(text))
+        if self._hs_db is not None:
+            # HS_FLAG_SINGLEMATCH: обработчик вызывается не более одного раза
+            matches = []
+            self._hs_db.scan(
+                text.encode('utf-8'),
+                match_event_handler=lambda *_: matches.append(True),
+                scratch=self._hs_scratch
+            )
+            return bool(matches)
+        return bool(self._code_patterns.search(text.lower()))
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Общая aiohttp сессия с таймаутами (создается при первом запросе)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(
+                    total=None, sock_connect=self.CONNECT_TIMEOUT, sock_read=self.READ_TIMEOUT
+                ),
+                connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60, ttl_dns_cache=300),
+                json_serialize=_json_dumps
+            )
+        return self._session
+
+    @staticmethod
+    def _is_retryable_status(status: int) -> bool:
+        """Временные ошибки сервера; прочие 4xx повтором не исправить"""
+        return status >= 500 or status in (408, 429)
+
+    def _take_retry_token(self) -> bool:
+        """Списание повтора из бюджета; False, если бюджет исчерпан"""
+        now = time.monotonic()
+        self._retry_tokens = min(
+            float(self.RETRY_BUDGET),
+            self._retry_tokens + (now - self._retry_refilled_at) * self.RETRY_BUDGET_REFILL
+        )
+        self._retry_refilled_at = now
+        if self._retry_tokens < 1:
+            return False
+        self._retry_tokens -= 1
+        return True
+
+    async def _backoff(self, attempt: int, deadline: float) -> bool:
+        """Пауза перед повтором; False, если попытки, бюджет повторов или срок исчерпаны"""
+        if attempt >= self.MAX_RETRIES:
+            return False
+        delay = random.uniform(0, min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2 ** attempt))
+        if time.monotonic() + delay >= deadline or not self._take_retry_token():
+            return False
+        logger.info("Повторная попытка %d/%d через %.2f с", attempt + 1, self.MAX_RETRIES, delay)
+        await asyncio.sleep(delay)
+        return True
 
     @asynccontextmanager
-    async def _create_session(self):
-        """Создание aiohttp сессии с таймаутом"""
-        timeout = aiohttp.ClientTimeout(total=self.timeout)
-        session = aiohttp.ClientSession(timeout=timeout)
+    async def _admit(self):
+        """Слот bulkhead; при переполненной очереди запрос отклоняется сразу"""
+        if self._bulkhead.locked() and self._queued >= self.MAX_QUEUED_REQUESTS:
+            raise LLMError("Очередь запросов к Ollama переполнена")
+        
+        self._queued += 1
         try:
-            yield session
+            await self._bulkhead.acquire()
         finally:
-            await session.close()
+            self._queued -= 1
+        try:
+            yield
+        finally:
+            self._bulkhead.release()
+
+    async def close(self):
+        """Закрытие сессии"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
 
     async def generate_answer_streaming(self, 
                                     question: str, 
@@ -52,31 +375,34 @@ class LLMAdapter:
         if flags is None:
             flags = []
         
-        logger.info(f"[LLM-1] Начало generate_answer_streaming. Флаги: {flags}")
+        logger.info("[LLM-1] Начало generate_answer_streaming. Флаги: %s", flags)
         
         # Защитный слой: отказываем в генерации исполняемого кода/SQL (если не отключено флагом)
-        if self._is_code_request(question) and '-nocode' not in flags:
+        is_code = self._is_code_request(question)
+        if is_code and '-nocode' not in flags:
             logger.info("[LLM-1a] Запрос заблокирован (код/SQL)")
             yield "Извините, я не могу помогать с генерацией исполняемого кода или SQL-запросов по соображениям безопасности."
             return
 
-        logger.info("[LLM-2] Создаем промпт")
-        prompt = self._create_prompt(question, context_docs, deep_think, flags)
+        logger.debug("[LLM-2] Создаем промпт")
+        prompt = self._create_prompt(question, context_docs, deep_think, flags, is_code=is_code)
         
-        logger.info("[LLM-3] Начинаем стриминг от Ollama")
+        logger.debug("[LLM-3] Начинаем стриминг от Ollama")
         try:
             chunk_count = 0
-            async for chunk in self._stream_from_ollama(prompt):
-                logger.info(f"[LLM-3a] Отправляем chunk #{chunk_count}: '{chunk}'")
+            debug = logger.isEnabledFor(logging.DEBUG)
+            stream = self._stream_from_ollama(prompt)
+            # Если активен простой режим, убираем лишние формальности
+            if '-simple' in flags:
+                stream = self._simplify_stream(stream)
+            
+            async for chunk in stream:
+                if debug:
+                    logger.debug("[LLM-3a] chunk #%d len=%d", chunk_count, len(chunk))
                 chunk_count += 1
-                
-                # Если активен простой режим, убираем лишние формальности
-                if '-simple' in flags:
-                    chunk = self._simplify_response(chunk)
-                    
                 yield chunk
                     
-            logger.info(f"[LLM-4] generate_answer_streaming завершен. Чанков: {chunk_count}")
+            logger.info("[LLM-4] generate_answer_streaming завершен. Чанков: %d", chunk_count)
             
         except Exception as e:
             logger.error(f"[LLM-ERROR] Ошибка в generate_answer_streaming: {e}")
@@ -85,54 +411,53 @@ class LLMAdapter:
     async def _stream_from_ollama(self, prompt: str) -> AsyncGenerator[str, None]:
         """Правильное потоковое получение ответа от Ollama API с ретраями"""
         url = f"{self.base_url}/api/generate"
-        payload = {
-            "model": self.model_name,
-            "prompt": prompt,
-            "stream": True,
-            "options": {
-                "temperature": 0.1,
-                "top_p": 0.9,
-                "num_predict": 600,
-                "repeat_penalty": 1.2
-            }
-        }
+        payload = {**self._base_payload, "prompt": prompt}
         
-        max_retries = 2
-        retry_delay = 1
+        chunk_count = 0
+        # Общий срок на запрос вместе с повторами и чтением потока
+        deadline = time.monotonic() + self.timeout
         
-        for attempt in range(max_retries + 1):
-            try:
-                async with self._create_session() as session:
-                    async with session.post(url, json=payload) as response:
-                        logger.info(f"Статус ответа: {response.status}")
-                        
-                        if response.status != 200:
-                            error_text = await response.text()
-                            logger.error(f"Ошибка Ollama API: {response.status} - {error_text}")
-                            
-                            if attempt < max_retries:
-                                logger.info(f"Повторная попытка {attempt + 1}/{max_retries}")
-                                await asyncio.sleep(retry_delay)
-                                continue
-                            else:
-                                yield "Ошибка соединения с моделью."
-                                return
+        # Bulkhead: слот занят на весь запрос, включая повторы и чтение потока
+        async with self._admit():
+            for attempt in range(self.MAX_RETRIES + 1):
+                if not self._breaker.allow():
+                    # Бэкенд недоступен: generate_answer_streaming сразу отдаст fallback-ответ
+                    raise LLMError(f"Ollama ({self.base_url}) недоступна, запрос отклонен предохранителем")
+            
+                # Срок мог истечь еще в очереди bulkhead
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    yield "Превышено время ожидания ответа."
+                    return
+                
+                retryable = True
+                try:
+                    session = await self._get_session()
+                    # Оставшееся до срока время ограничивает попытку целиком, включая чтение тела
+                    attempt_timeout = aiohttp.ClientTimeout(
+                        total=remaining,
+                        sock_connect=self.CONNECT_TIMEOUT,
+                        sock_read=self.READ_TIMEOUT
+                    )
+                    async with session.post(url, json=payload, timeout=attempt_timeout) as response:
+                        logger.debug("Статус ответа: %s", response.status)
                         
-                        logger.info("Начинаем чтение потока...")
-                        chunk_count = 0
+                        if response.status == 200:
+                            self._breaker.record_success()
+                            logger.debug("Начинаем чтение потока...")
                         
-                        async for line_bytes in response.content:
-                            if line_bytes:
-                                line = line_bytes.decode('utf-8').strip()
+                            async for line_bytes in _iter_lines(response.content):
+                                # Строка разбирается прямо из bytes, без decode в str
+                                line = line_bytes.strip()
                                 
                                 if not line:
                                     continue
                                     
                                 try:
-                                    data = json.loads(line)
+                                    data = _json_loads(line)
                                     
                                     if data.get('done', False):
-                                        logger.info(f"Стриминг завершен. Чанков: {chunk_count}")
+                                        logger.debug("Стриминг завершен. Чанков: %d", chunk_count)
                                         break
                                     
                                     if 'response' in data and data['response']:
@@ -144,141 +469,136 @@ class LLMAdapter:
                                 except Exception:
                                     continue
                         
-                        logger.info("Поток успешно завершен")
-                        return
+                            logger.debug("Поток успешно завершен")
+                            return
+                    
+                        error_text = await response.text()
+                        logger.error(f"Ошибка Ollama API: {response.status} - {error_text}")
+                        failure = "Ошибка соединения с моделью."
+                        retryable = self._is_retryable_status(response.status)
                                         
-            except asyncio.TimeoutError:
-                logger.warning(f"Таймаут на попытке {attempt + 1}")
-                if attempt < max_retries:
-                    await asyncio.sleep(retry_delay)
-                    continue
-                else:
-                    yield "Превышено время ожидания ответа."
-                    return
-            except aiohttp.ClientConnectorError:
-                logger.error("Не удалось подключиться к Ollama")
-                yield "Не удалось подключиться к языковой модели."
-                return
-            except Exception as e:
-                logger.error(f"Неожиданная ошибка: {e}")
-                if attempt < max_retries:
-                    await asyncio.sleep(retry_delay)
-                    continue
-                else:
+                except asyncio.TimeoutError:
+                    logger.warning(f"Таймаут на попытке {attempt + 1}")
+                    failure = "Превышено время ожидания ответа."
+                except aiohttp.ClientConnectorError as e:
+                    logger.error(f"Не удалось подключиться к Ollama: {e}")
+                    failure = "Не удалось подключиться к языковой модели."
+                except aiohttp.ClientConnectionError as e:
+                    logger.error(f"Соединение с Ollama прервано: {e}")
+                    failure = "Произошла ошибка при генерации ответа."
+                except Exception as e:
+                    # Не сетевые ошибки не исправятся повтором
+                    logger.error(f"Неожиданная ошибка: {e}")
                     yield "Произошла ошибка при генерации ответа."
                     return
+            
+                # Временные сбои (таймаут, соединение, 5xx/408/429) размыкают предохранитель
+                if retryable:
+                    self._breaker.record_failure()
+            
+                # Повтор после частично отданного ответа продублировал бы текст
+                if not retryable or chunk_count or not await self._backoff(attempt, deadline):
+                    yield failure
+                    return
 
     async def generate_answer(self, 
                             question: str, 
                             context_docs: List[str],
                             deep_think: bool = False) -> str:
         """Обычная генерация ответа (для обратной совместимости)"""
-        full_response = ""
+        parts = []
         async for chunk in self.generate_answer_streaming(question, context_docs, deep_think):
-            full_response += chunk
-        return full_response
+            parts.append(chunk)
+        return "".join(parts)
+
+    def _prompt_kind(self, question: str, deep_think: bool, flags: List[str]) -> str:
+        """Выбор шаблона промпта; точка расширения для наследников"""
+        if _INVEST_PROMPT_RE.search(question):
+            return 'invest'
+        if deep_think:
+            return 'deep_think'
+        if '-simple' in flags:
+            return 'simple'
+        return 'default'
 
     def _create_prompt(self, 
                     question: str, 
                     context_docs: List[str],
                     deep_think: bool,
-                    flags: List[str]) -> str:
-        """Улучшенный промпт для инвестиционных вопросов"""
-        
-        context_text = "\n".join(context_docs) if context_docs else "Информация не найдена"
-        
-        question_lower = question.lower()
-        if any(word in question_lower for word in ['акции', 'инвестиц', 'вложить', 'куда вложить', 'выгодн', 'портфель']):
-            return f"""Ты - финансовый консультант. Дай конкретные рекомендации по инвестициям в акции.
-
-    ВОПРОС КЛИЕНТА: {question}
-
-    БАЗА ЗНАНИЙ ОБ АКЦИЯХ:
-    {context_text}
-
-    ИНСТРУКЦИИ:
-    - Дай конкретные рекомендации по акциям
-    - Объясни почему именно эти акции
-    - Учитывай риск и потенциальную доходность
-    - Предложи диверсификацию портфеля
-    - Будь конкретен и практичен
-
-    ОТВЕТ:"""
-        
-        elif deep_think:
-            return f"""ПРОЦЕСС МЫШЛЕНИЯ:
+                    flags: List[str],
+                    is_code: Optional[bool] = None) -> str:
+        """Промпт по шаблону, выбранному _prompt_kind
 
-    1. АНАЛИЗ ЗАПРОСА:
-    - Вопрос пользователя: "{question}"
-    - Возможное намерение: {self._analyze_intent(question)}
-    - Соответствие политике безопасности: {"Соответствует" if not self._is_code_request(question) else "❌ Нарушает"}
-
-    2. ИНФОРМАЦИЯ ДЛЯ ОТВЕТА:
-    {context_text}
-
-    3. ЛОГИЧЕСКИЙ АНАЛИЗ:
-    - Какая информация наиболее релевантна?
-    - Что именно спрашивает пользователь?
-    - Какие детали важны для полного ответа?
-
-    4. ФОРМИРОВАНИЕ ОТВЕТА:
-    - Структурировать информацию логически
-    - Выделить ключевые моменты
-    - Дать практические рекомендации
-
-    ОТВЕТ:"""
-        
-        elif '-simple' in flags:
-            # Простой режим
-            return f"Вопрос: {question}\nДанные: {context_text}\nКраткий ответ:"
-            
-        else:
-            # Обычный режим
-            return f"""Ответь на вопрос: {question}
+        is_code - уже вычисленный результат _is_code_request(question), чтобы
+        не проверять вопрос повторно.
+        """
+        kind = self._prompt_kind(question, deep_think, flags)
+        intent = policy = None
+        if kind == 'deep_think':
+            intent = self._analyze_intent(question)
+            if is_code is None:
+                is_code = self._is_code_request(question)
+            policy = "Соответствует" if not is_code else "❌ Нарушает"
+        return _render_prompt(
+            self.PROMPT_TEMPLATES[kind], question, self._limit_context(context_docs), intent, policy
+        )
 
-    Информация для ответа:
-    {context_text}
+    def _limit_context(self, context_docs: Optional[List[str]]) -> tuple:
+        """Не более MAX_CTX_DOCS документов по MAX_DOC_CHARS символов и MAX_TOTAL_CHARS всего
 
-    Ответ:"""    
+        Документы идут по убыванию релевантности, поэтому при превышении
+        общего лимита отбрасываются последние.
+        """
+        docs = [doc[:self.MAX_DOC_CHARS] for doc in (context_docs or ())[:self.MAX_CTX_DOCS]]
+        # Длина объединенного контекста: документы и переводы строк между ними
+        total = sum(map(len, docs)) + max(len(docs) - 1, 0)
+        while len(docs) > 1 and total > self.MAX_TOTAL_CHARS:
+            total -= len(docs.pop()) + 1
+        return tuple(docs)
         
     def _analyze_intent(self, question: str) -> str:
-        """Анализ намерения пользователя"""
-        question_lower = question.lower()
-        
-        if any(word in question_lower for word in ['что такое', 'определ', 'означает']):
-            return "получить определение понятия"
-        elif any(word in question_lower for word in ['как', 'процесс', 'оформить']):
-            return "узнать процесс оформления"
-        elif any(word in question_lower for word in ['документ', 'нужно', 'требуется']):
-            return "узнать необходимые документы"
-        elif any(word in question_lower for word in ['ставк', 'процент', 'сколько стоит']):
-            return "узнать стоимость или ставки"
-        elif any(word in question_lower for word in ['акции', 'инвестиц', 'вложить']):
-            return "получить инвестиционные рекомендации"
-        else:
-            return "общий информационный запрос"
+        """Анализ намерения пользователя (один проход по вопросу, результат кэшируется)"""
+        return _analyze_intent_text(question)
     
     def _fallback_answer(self, context_docs: List[str]) -> str:
         """Ответ при ошибке LLM"""
         if not context_docs:
             return "Информация по вашему запросу не найдена в базе знаний."
         
-        return "Найденная информация:\n" + "\n".join(
-            [f"• {doc[:100]}..." if len(doc) > 100 else f"• {doc}" 
-             for doc in context_docs[:3]]
-        )
+        bullets = [doc if len(doc) <= 100 else doc[:100] + "..." for doc in context_docs[:3]]
+        return "Найденная информация:\n• " + "\n• ".join(bullets)
+
+    async def _simplify_stream(self, chunks: AsyncGenerator[str, None]) -> AsyncGenerator[str, None]:
+        """Простой режим для потока: обороты вырезаются из буфера с удержанием хвоста
+
+        Обработка каждого чанка по отдельности не находила обороты, разбитые
+        между токенами, и срезала пробелы на границах токенов. Теперь последние
+        _SIMPLIFY_HOLD символов придерживаются до следующего чанка, а пробелы
+        убираются только в начале и в конце всего ответа.
+        """
+        pending = ""
+        started = False
+        async for chunk in chunks:
+            pending += chunk
+            if not _SIMPLIFY_FIRST_CHARS.isdisjoint(pending):
+                pending = _SIMPLIFY_RE.sub("", pending)
+            if not started:
+                pending = pending.lstrip()
+            
+            cut = len(pending) - _SIMPLIFY_HOLD
+            if cut > 0:
+                started = True
+                yield pending[:cut]
+                pending = pending[cut:]
+        
+        pending = pending.rstrip()
+        if pending:
+            yield pending
 
     def _simplify_response(self, text: str) -> str:
         """Упрощение ответа для простого режима"""
-        # Убираем формальные обращения и лишние слова
-        simplifications = {
-            "Конечно,": "",
-            "Рад помочь!": "",
-            "Вот ответ на ваш вопрос:": "",
-            "Согласно предоставленной информации,": ""
-        }
-        
-        for old, new in simplifications.items():
-            text = text.replace(old, new)
+        # Убираем формальные обращения и лишние слова одним проходом
+        if not _SIMPLIFY_FIRST_CHARS.isdisjoint(text):
+            text = _SIMPLIFY_RE.sub("", text)
         
         return text.strip()
\ No newline at end of file
@@ -1,8 +1,12 @@
+import atexit
 import logging
+import queue
 import warnings
 import os
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from typing import Optional
 import sys
+import time
 from contextlib import contextmanager
 
 @contextmanager
@@ -19,28 +23,87 @@ def suppress_stdout():
             sys.stdout = old_stdout
             sys.stderr = old_stderr
 
+# Уровень корневого логгера; для отладки AI_ASSISTANT_LOG_LEVEL=DEBUG
+LOG_LEVEL_ENV = 'AI_ASSISTANT_LOG_LEVEL'
+# Ротация файла лога
+LOG_MAX_BYTES = 50_000_000
+LOG_BACKUP_COUNT = 5
+
+# Поток записи логов; при повторной настройке старый останавливается
+_listener: Optional[QueueListener] = None
+
+class _CachedTimeFormatter(logging.Formatter):
+    """Форматтер, вызывающий strftime для asctime не чаще раза в секунду
+
+    Вывод совпадает с logging.Formatter: меняется только число вызовов
+    strftime, остальное берется из кэша текущей секунды.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (секунда, отформатированная дата) одним кортежем: замена атомарна
+        self._second_cache = (None, '')
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        
+        second = int(record.created)
+        cached_second, prefix = self._second_cache
+        if second != cached_second:
+            prefix = time.strftime(self.default_time_format, self.converter(second))
+            self._second_cache = (second, prefix)
+        return self.default_msec_format % (prefix, record.msecs)
+
 def setup_logging(log_file: Optional[str] = None) -> logging.Logger:
-    """Настройка логирования приложения"""
-    if log_file:
-        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    """Настройка логирования приложения
+
+    По умолчанию корневой логгер на уровне WARNING: отладочные записи
+    горячих путей (стриминг) отсекаются до форматирования. Запись в файл
+    и консоль идет в отдельном потоке QueueListener: вызов логгера из event
+    loop только кладет запись в очередь и не ждет диска.
+    """
+    global _listener
+    
+    log_dir = os.path.dirname(log_file) if log_file else ''
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
     
-    formatter = logging.Formatter(
+    # Поля записи, которые форматтер не использует: без поиска кадра
+    # вызывающего кода и без запросов имени потока/процесса на каждую запись
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    logging._srcfile = None
+    
+    formatter = _CachedTimeFormatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
+    level = os.getenv(LOG_LEVEL_ENV, 'WARNING').upper()
+    root_logger.setLevel(getattr(logging, level, logging.WARNING))
     root_logger.handlers.clear()
+    if _listener is not None:
+        _listener.stop()
     
+    handlers = []
     if log_file:
-        file_handler = logging.FileHandler(log_file)
+        file_handler = RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
         file_handler.setFormatter(formatter)
-        root_logger.addHandler(file_handler)
+        handlers.append(file_handler)
     
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
     console_handler.setLevel(logging.ERROR)
-    root_logger.addHandler(console_handler)
+    handlers.append(console_handler)
+    
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
     
     warnings.filterwarnings("ignore", category=RuntimeWarning)
     warnings.filterwarnings("ignore", category=UserWarning)
@@ -50,4 +113,10 @@ def setup_logging(log_file: Optional[str] = None) -> logging.Logger:
     logging.getLogger('tokenizers').setLevel(logging.ERROR)
     logging.getLogger('torch').setLevel(logging.ERROR)
     
-    return root_logger
\ No newline at end of file
+    return root_logger
+
+@atexit.register
+def _stop_listener() -> None:
+    """Дописать оставшиеся в очереди записи при выходе"""
+    if _listener is not None:
+        _listener.stop()
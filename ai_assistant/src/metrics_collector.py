@@ -1,7 +1,22 @@
-from typing import Dict, Any
-from prometheus_client import Counter, Histogram
+from collections import Counter as IntentCounter
+from typing import Dict, Any, Optional
+from prometheus_client import Counter, Histogram, generate_latest
+from prometheus_client.utils import floatToGoString
+import os
 import time
 
+# Переменная окружения, включающая собственную сериализацию /metrics
+FAST_METRICS_ENV = 'AI_ASSISTANT_FAST_METRICS'
+
+# Суффиксы сэмплов, которые generate_latest выводит отдельными семействами
+_OM_SUFFIXES = ('_created', '_gsum', '_gcount')
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', r'\\').replace('\n', r'\n')
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
 class MetricsCollector:
     """Сбор метрик работы ассистента"""
     def __init__(self):
@@ -15,38 +30,96 @@ class MetricsCollector:
             'Время ответа'
         )
         
-        # Локальные метрики
-        self._local = {
-            'total_queries': 0,
-            'successful_responses': 0,
-            'total_time': 0.0,
-            'intent_distribution': {}
-        }
+        # Локальные метрики: отдельные атрибуты вместо словаря, чтобы
+        # каждое обновление было одной операцией над атрибутом
+        self._total_queries = 0
+        self._successful = 0
+        self._total_time = 0.0
+        self._intent = IntentCounter()
+        self._cache_lookups = 0
+        self._cache_hits = 0
+        
+        # Собственная сериализация только метрик ассистента; по умолчанию
+        # используется стандартный generate_latest
+        self.fast_metrics_text = os.getenv(FAST_METRICS_ENV, '').lower() in ('1', 'true', 'yes')
+        # Заголовки HELP/TYPE неизменны и кодируются один раз
+        self._headers: Dict[tuple, bytes] = {}
     
     def log_query(self, question: str, intent: str, 
-                 response_time: float, success: bool = True) -> None:
+                 response_time: float, success: bool = True,
+                 cache_hit: Optional[bool] = None) -> None:
         """Логирование метрик запроса"""
-        try:
-            self.request_counter.inc()
-            self.response_time.observe(response_time)
-        except Exception:
-            pass
+        self.request_counter.inc()
+        self.response_time.observe(response_time)
             
-        self._local['total_queries'] += 1
-        if success:
-            self._local['successful_responses'] += 1
-        self._local['total_time'] += response_time
-        self._local['intent_distribution'][intent] = \
-            self._local['intent_distribution'].get(intent, 0) + 1
+        self._total_queries += 1
+        self._successful += success
+        self._total_time += response_time
+        self._intent[intent] += 1
+        
+        # Попадание в кэш эмбеддингов вопросов (None - кэш не использовался)
+        if cache_hit is not None:
+            self._cache_lookups += 1
+            self._cache_hits += cache_hit
     
     def get_metrics(self) -> Dict[str, Any]:
         """Получение текущих метрик"""
-        avg_time = (self._local['total_time'] / self._local['total_queries']) \
-            if self._local['total_queries'] else 0.0
+        avg_time = (self._total_time / self._total_queries) \
+            if self._total_queries else 0.0
+        hit_rate = (self._cache_hits / self._cache_lookups) \
+            if self._cache_lookups else 0.0
             
         return {
-            'total_queries': self._local['total_queries'],
-            'successful_responses': self._local['successful_responses'],
+            'total_queries': self._total_queries,
+            'successful_responses': self._successful,
             'avg_response_time': avg_time,
-            'intent_distribution': self._local['intent_distribution']
-        }
\ No newline at end of file
+            'intent_distribution': dict(self._intent),
+            'cache_hit_rate': hit_rate
+        }
+    
+    def get_metrics_text(self) -> bytes:
+        """Метрики Prometheus в текстовом формате для /metrics"""
+        if not self.fast_metrics_text:
+            return generate_latest()
+        return b''.join(self._metrics_chunks())
+    
+    def _metrics_chunks(self):
+        """Строки метрик ассистента в том же виде, что и у generate_latest"""
+        for collector in (self.request_counter, self.response_time):
+            for metric in collector.collect():
+                mname = metric.name + '_total' if metric.type == 'counter' else metric.name
+                yield self._header(mname, metric.type, metric.documentation)
+                
+                extra = {}
+                for s in metric.samples:
+                    line = self._sample_line(s)
+                    for suffix in _OM_SUFFIXES:
+                        if s.name == metric.name + suffix:
+                            extra.setdefault(suffix, []).append(line)
+                            break
+                    else:
+                        yield line
+                
+                for suffix, lines in sorted(extra.items()):
+                    yield self._header(metric.name + suffix, 'gauge', metric.documentation)
+                    yield from lines
+    
+    def _header(self, name: str, mtype: str, documentation: str) -> bytes:
+        key = (name, mtype)
+        header = self._headers.get(key)
+        if header is None:
+            header = self._headers[key] = (
+                f'# HELP {name} {_escape_help(documentation)}\n'
+                f'# TYPE {name} {mtype}\n'
+            ).encode('utf-8')
+        return header
+    
+    @staticmethod
+    def _sample_line(s) -> bytes:
+        labels = ''
+        if s.labels:
+            labels = '{' + ','.join(
+                f'{k}="{_escape_label(v)}"' for k, v in s.labels.items()
+            ) + '}'
+        timestamp = f' {int(float(s.timestamp) * 1000):d}' if s.timestamp is not None else ''
+        return f'{s.name}{labels} {floatToGoString(s.value)}{timestamp}\n'.encode('utf-8')
@@ -1,4 +1,6 @@
+import functools
 import logging
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 import numpy as np
 from qdrant_client import QdrantClient
@@ -6,25 +8,54 @@ from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams
 import uuid
 import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
 from sentence_transformers import SentenceTransformer
+from .cache_manager import text_key
 
 logger = logging.getLogger(__name__)
 
 class QdrantManager:
     """Менеджер векторной БД Qdrant"""
     
+    # Емкость LRU-кэша эмбеддингов запросов
+    EMBEDDING_CACHE_SIZE = 4096
+    # Скалярное int8-квантование векторов на стороне Qdrant: квантиль для
+    # отсечения выбросов и запас кандидатов для пересчета по исходным float32
+    QUANTIZATION_QUANTILE = 0.99
+    SEARCH_OVERSAMPLING = 2.0
+    # Загрузка документов пакетами: кодирование следующего пакета идет
+    # параллельно с отправкой предыдущего, в полете не больше двух upsert
+    UPSERT_BATCH_SIZE = 64
+    MAX_INFLIGHT_UPSERTS = 2
+    
     def __init__(self, 
                  host: str = "localhost", 
                  port: int = 6333,
                  collection_name: str = "financial_documents",
-                 vector_size: int = 312):
+                 vector_size: int = 312,
+                 batch_size: int = 32):
         self.client = QdrantClient(host=host, port=port)
         self.collection_name = collection_name
         self.vector_size = vector_size
+        # Размер пакета при кодировании документов
+        self.batch_size = batch_size
         self.embedder = None
+        # Один постоянный поток на модель: encode сам распараллелен внутри
+        # torch/BLAS, лишние потоки Python только конкурируют за ядра
+        self._encode_pool: Optional[Executor] = None
+        self._owns_pool = False
+        # LRU-кэш нормированных эмбеддингов запросов по 64-битному ключу текста;
+        # обращения идут только из event loop, блокировка не нужна
+        self._emb_cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
         
-    async def initialize(self, embedder: SentenceTransformer):
+    async def initialize(self, embedder: SentenceTransformer, executor: Optional[Executor] = None):
+        """Подключение модели; executor - пул, уже закрепленный за этой моделью"""
         self.embedder = embedder
+        if executor is not None:
+            self._encode_pool = executor
+        elif self._encode_pool is None:
+            self._encode_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='encode')
+            self._owns_pool = True
         
         try:
             collections = self.client.get_collections().collections
@@ -35,7 +66,15 @@ class QdrantManager:
                     collection_name=self.collection_name,
                     vectors_config=VectorParams(
                         size=self.vector_size,
-                        distance=Distance.COSINE
+                        distance=Distance.COSINE,
+                        on_disk=False
+                    ),
+                    quantization_config=models.ScalarQuantization(
+                        scalar=models.ScalarQuantizationConfig(
+                            type=models.ScalarType.INT8,
+                            quantile=self.QUANTIZATION_QUANTILE,
+                            always_ram=True
+                        )
                     )
                 )
                 logger.info(f"Создана коллекция {self.collection_name}")
@@ -46,72 +85,118 @@ class QdrantManager:
             logger.error(f"Ошибка инициализации Qdrant: {e}")
             raise
 
-    async def add_documents(self, documents: List[str], metadata: List[Dict] = None) -> bool:
+    async def add_documents(self, documents: List[str], metadata: List[Dict] = None,
+                            embeddings: Optional[np.ndarray] = None) -> bool:
+        """Загрузка документов; готовые эмбеддинги (N, D) повторно не вычисляются"""
         if not documents:
             return False
             
         try:
-            embeddings = await self._generate_embeddings_batch(documents)
+            loop = asyncio.get_event_loop()
+            inflight = asyncio.Semaphore(self.MAX_INFLIGHT_UPSERTS)
             
-            points = []
-            for i, (doc, embedding) in enumerate(zip(documents, embeddings)):
-                point_id = str(uuid.uuid4())
-                
-                point_metadata = {
-                    "text": doc,
-                    "document_id": i,
-                    "length": len(doc)
-                }
-                
-                if metadata and i < len(metadata):
-                    point_metadata.update(metadata[i])
-                
-                points.append(
-                    models.PointStruct(
-                        id=point_id,
-                        vector=embedding.tolist(),
-                        payload=point_metadata
-                    )
-                )
+            async def upsert(batch: models.Batch) -> None:
+                try:
+                    await loop.run_in_executor(None, functools.partial(
+                        self.client.upsert,
+                        collection_name=self.collection_name,
+                        points=batch
+                    ))
+                finally:
+                    inflight.release()
             
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=points
-            )
+            upserts = []
+            try:
+                for start in range(0, len(documents), self.UPSERT_BATCH_SIZE):
+                    chunk = documents[start:start + self.UPSERT_BATCH_SIZE]
+                    if embeddings is None:
+                        vectors = await self._generate_embeddings_batch(chunk)
+                    else:
+                        vectors = embeddings[start:start + len(chunk)]
+                    
+                    await inflight.acquire()
+                    batch = self._make_batch(chunk, start, vectors, metadata)
+                    upserts.append(asyncio.ensure_future(upsert(batch)))
+            finally:
+                # Дожидаемся уже отправленных пакетов даже при ошибке кодирования
+                results = await asyncio.gather(*upserts, return_exceptions=True)
+            
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
             
-            logger.info(f"Добавлено {len(points)} документов в Qdrant")
+            logger.info(f"Добавлено {len(documents)} документов в Qdrant")
             return True
             
         except Exception as e:
             logger.error(f"Ошибка добавления документов в Qdrant: {e}")
             return False
 
+    @staticmethod
+    def _make_batch(documents: List[str], offset: int, vectors: np.ndarray,
+                    metadata: Optional[List[Dict]]) -> models.Batch:
+        """Пакет точек в колоночном виде (ids, vectors, payloads)"""
+        payloads = []
+        for i, doc in enumerate(documents, offset):
+            point_metadata = {
+                "text": doc,
+                "document_id": i,
+                "length": len(doc)
+            }
+            
+            if metadata and i < len(metadata):
+                point_metadata.update(metadata[i])
+            payloads.append(point_metadata)
+        
+        # Один вызов tolist на весь пакет; векторы уходят в float32,
+        # квантует их сам сервер
+        return models.Batch(
+            ids=[str(uuid.uuid4()) for _ in documents],
+            vectors=np.asarray(vectors, dtype=np.float32).tolist(),
+            payloads=payloads
+        )
+
     async def search_similar(self, 
                            query: str, 
                            top_k: int = 5,
-                           score_threshold: float = 0.7) -> List[Dict[str, Any]]:
+                           score_threshold: float = 0.7,
+                           query_embedding: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """Поиск похожих документов; готовый эмбеддинг запроса повторно не вычисляется"""
         if not self.embedder:
             raise RuntimeError("Embedder не инициализирован")
             
         try:
-            query_embedding = await self._generate_embedding(query)
+            if query_embedding is None:
+                query_embedding = await self._generate_embedding(query)
+            else:
+                query_embedding = np.asarray(query_embedding, dtype=np.float32).ravel()
             
             search_result = self.client.search(
                 collection_name=self.collection_name,
                 query_vector=query_embedding.tolist(),
                 limit=top_k,
-                score_threshold=score_threshold
+                score_threshold=score_threshold,
+                with_vectors=False,
+                search_params=models.SearchParams(
+                    quantization=models.QuantizationSearchParams(
+                        rescore=True,
+                        oversampling=self.SEARCH_OVERSAMPLING
+                    )
+                )
             )
             
+            # Payload каждого ответа разбирается заново и принадлежит нам:
+            # текст извлекается из него на месте, остаток и есть метаданные
             results = []
             for hit in search_result:
+                payload = hit.payload or {}
                 results.append({
-                    "text": hit.payload.get("text", ""),
+                    "text": payload.pop("text", ""),
                     "score": hit.score,
-                    "metadata": {k: v for k, v in hit.payload.items() if k != "text"}
+                    "metadata": payload
                 })
             
-            logger.info(f"Найдено {len(results)} похожих документов для запроса: '{query}'")
+            logger.debug("Найдено %d похожих документов для запроса: '%s'", len(results), query)
             return results
             
         except Exception as e:
@@ -119,16 +204,39 @@ class QdrantManager:
             return []
 
     async def _generate_embedding(self, text: str) -> np.ndarray:
+        """Нормированный эмбеддинг запроса; повторные запросы берутся из LRU-кэша"""
+        key = text_key(text)
+        cached = self._emb_cache.get(key)
+        if cached is not None:
+            self._emb_cache.move_to_end(key)
+            return cached
+        
         loop = asyncio.get_event_loop()
         embedding = await loop.run_in_executor(
-            None, self.embedder.encode, [text]
+            self._encode_pool, self.embedder.encode, [text]
         )
-        return embedding[0]
+        vector = np.asarray(embedding[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        
+        self._emb_cache[key] = vector
+        if len(self._emb_cache) > self.EMBEDDING_CACHE_SIZE:
+            self._emb_cache.popitem(last=False)
+        return vector
 
-    async def _generate_embeddings_batch(self, texts: List[str]) -> List[np.ndarray]:
+    async def _generate_embeddings_batch(self, texts: List[str]) -> np.ndarray:
+        # sentence-transformers сам сортирует тексты по длине внутри encode,
+        # поэтому пакеты собираются из текстов близкой длины с минимальным паддингом
         loop = asyncio.get_event_loop()
         embeddings = await loop.run_in_executor(
-            None, self.embedder.encode, texts
+            self._encode_pool, lambda: self.embedder.encode(
+                list(texts),
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
         )
         return embeddings
 
@@ -144,6 +252,13 @@ class QdrantManager:
             logger.error(f"Ошибка получения информации о коллекции: {e}")
             return {}
 
+    def close(self) -> None:
+        """Остановка собственного пула кодирования (общий пул закрывает владелец)"""
+        if self._owns_pool and self._encode_pool is not None:
+            self._encode_pool.shutdown(wait=False)
+        self._encode_pool = None
+        self._owns_pool = False
+
     async def clear_collection(self) -> bool:
         try:
             self.client.delete_collection(self.collection_name)
@@ -1,10 +1,25 @@
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, List, Optional
+import functools
 import json
 import logging
 import re
 
 logger = logging.getLogger(__name__)
 
+# Слова, по которым запрещенный паттерн считается проверкой кода (снимается флагом -nocode)
+_CODE_PATTERN_WORDS = ('код', 'sql', 'команду')
+
+@functools.lru_cache(maxsize=8)
+def _compile_patterns(patterns: Tuple[str, ...]) -> Optional['re.Pattern']:
+    """Одно выражение для всех запрещенных подстрок, общее для экземпляров с теми же правилами
+
+    Опережающая проверка не поглощает символы: за один проход по тексту
+    находятся все позиции, где начинается какой-либо паттерн.
+    """
+    if not patterns:
+        return None
+    return re.compile('(?=(' + '|'.join(map(re.escape, patterns)) + '))')
+
 class SecurityError(Exception):
     """Базовый класс для ошибок безопасности"""
     pass
@@ -30,6 +45,14 @@ class SecurityChecker:
             r'написать код', r'сгенерируй sql', r'запрос sql', r'выполнить sql', r'как выполнить sql'
         ]
         self._code_regex = re.compile("|".join(self._code_patterns), flags=re.IGNORECASE)
+        
+        # Запрещенные паттерны из правил: порядок в файле задает приоритет сообщения
+        patterns = tuple(self.rules.get('dangerous_patterns', {}))
+        self._pattern_priority = {pattern: i for i, pattern in enumerate(patterns)}
+        self._dangerous_regex = _compile_patterns(patterns)
+        self._nocode_regex = _compile_patterns(tuple(
+            p for p in patterns if not any(word in p for word in _CODE_PATTERN_WORDS)
+        ))
 
     def _load_rules(self, path: str) -> Dict[str, Any]:
         try:
@@ -52,40 +75,68 @@ class SecurityChecker:
         return clean_text, flags_found
 
     async def check(self, text: str) -> Tuple[bool, str]:
-        """Проверка безопасности текста с поддержкой флагов"""
+        """Асинхронная проверка для существующих вызовов через await
+
+        Возвращает прежнюю пару (признак безопасности, причина отказа);
+        намерение запроса доступно через check_sync.
+        """
+        is_safe, reason, _ = self.check_sync(text)
+        return is_safe, reason
+
+    def check_sync(self, text: str) -> Tuple[bool, str, str]:
+        """Проверка безопасности текста с поддержкой флагов
+        
+        Проверка не выполняет ввода-вывода, поэтому синхронна: вызов из
+        event loop не создает корутину и не проходит через планировщик.
+        
+        Returns:
+            Tuple[bool, str, str]: Признак безопасности, причина отказа и
+                намерение запроса (то же, что вернул бы analyze_intent)
+        """
         # Извлекаем флаги и очищаем текст
         clean_text, flags = self._extract_flags(text)
         
         # Если флаг -notrigger активен, пропускаем все проверки
         if '-notrigger' in flags:
             logger.info("Режим -notrigger: проверки безопасности отключены")
-            return True, "Рeжим без триггеров активирован"
+            return True, "Рeжим без триггеров активирован", "general"
         
         text_l = clean_text.lower()
+        
+        # Поиск кода выполняется один раз и используется и для интента, и для блокировки
+        code_match = self._code_regex.search(clean_text) is not None
+        intent = self._detect_intent(text_l, flags, code_match)[0] if text else "unknown"
 
-        # Проверяем явные запрещённые паттерны из rules
-        for pattern, action in self.rules.get('dangerous_patterns', {}).items():
-            if pattern in text_l:
-                # Если флаг -nocode активен и это код-запрос, пропускаем
-                if '-nocode' in flags and any(code_word in pattern for code_word in ['код', 'sql', 'команду']):
-                    logger.info("Режим -nocode: проверка кода отключена")
-                    continue
-                    
-                msg = self.rules.get('rejection_messages', {}).get(
-                    pattern,
-                    self.rules.get('rejection_messages', {}).get('default', 'Запрос отклонен по политике безопасности.')
-                )
-                return False, msg
+        # Проверяем явные запрещённые паттерны из rules одним проходом;
+        # при флаге -nocode паттерны проверки кода исключены заранее
+        pattern = self._find_dangerous_pattern(text_l, '-nocode' in flags)
+        if pattern is not None:
+            msg = self.rules.get('rejection_messages', {}).get(
+                pattern,
+                self.rules.get('rejection_messages', {}).get('default', 'Запрос отклонен по политике безопасности.')
+            )
+            return False, msg, intent
 
         # Дополнительно блокируем запросы, явно требующие написания исполняемого кода / SQL
-        if self._code_regex.search(clean_text) and '-nocode' not in flags:
+        if code_match and '-nocode' not in flags:
             msg = self.rules.get('rejection_messages', {}).get(
                 'code',
                 'Извините, я не могу генерировать программный код или инструкции для выполнения SQL-запросов.'
             )
-            return False, msg
+            return False, msg, intent
 
-        return True, ""
+        return True, "", intent
+
+    def _find_dangerous_pattern(self, text_l: str, nocode: bool) -> Optional[str]:
+        """Найденный в тексте запрещенный паттерн с наивысшим приоритетом"""
+        regex = self._nocode_regex if nocode else self._dangerous_regex
+        if regex is None:
+            return None
+        return min(
+            {m.group(1) for m in regex.finditer(text_l)},
+            key=self._pattern_priority.__getitem__,
+            default=None
+        )
 
     def analyze_intent(self, text: str) -> Tuple[str, float]:
         """Определение намерения в запросе с учетом флагов"""
@@ -99,12 +150,17 @@ class SecurityChecker:
         if '-notrigger' in flags:
             return "general", 0.9
 
+        return self._detect_intent(
+            clean_text.lower(), flags, self._code_regex.search(clean_text) is not None
+        )
+
+    def _detect_intent(self, text_l: str, flags: List[str], code_match: bool) -> Tuple[str, float]:
+        """Определение намерения по очищенному тексту в нижнем регистре"""
         # Простая логика определения интента
-        if self._code_regex.search(clean_text) and '-nocode' not in flags:
+        if code_match and '-nocode' not in flags:
             return "code", 0.95
 
         # Финансовые интенты
-        text_l = clean_text.lower()
         if any(k in text_l for k in ["ипотек", "кредит", "вклад", "карта", "ставк"]):
             return "finance", 0.8
 
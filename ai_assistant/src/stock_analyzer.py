@@ -1,126 +1,159 @@
 """Анализатор акций и инвестиционных рекомендаций"""
 import logging
-from typing import Dict, List, Any
+import re
+from dataclasses import asdict, dataclass
+from types import MappingProxyType
+from typing import Dict, List, Any, Mapping, Optional, Tuple
 from datetime import datetime
-import asyncio
 
 logger = logging.getLogger(__name__)
 
+# Ключевые слова стратегий в порядке приоритета
+_STRATEGY_KEYWORDS = (
+    ('conservative', ('консерватив', 'сохран', 'надежн')),
+    ('dividend', ('дивиденд', 'доход', 'выплат')),
+    ('growth', ('агрессив', 'рост', 'потенциал')),
+    ('balanced', ('начать', 'начал', 'новичок')),
+)
+_STRATEGY_PRIORITY = {name: i for i, (name, _) in enumerate(_STRATEGY_KEYWORDS)}
+
+# Все ключевые слова в одном выражении: опережающая проверка находит
+# перекрывающиеся вхождения разных стратегий за один проход по тексту
+_STRATEGY_RE = re.compile('(?=' + '|'.join(
+    f"(?P<{name}>{'|'.join(map(re.escape, words))})" for name, words in _STRATEGY_KEYWORDS
+) + ')')
+
+# Профили акций и стратегии: неизменяемые таблицы, создаются один раз при импорте
+@dataclass(frozen=True, slots=True)
+class StockProfile:
+    """Профиль акции"""
+    name: str
+    sector: Optional[str] = None
+    risk: Optional[str] = None
+    potential: Optional[str] = None
+    dividend_yield: Optional[str] = None
+    description: Optional[str] = None
+
+@dataclass(frozen=True, slots=True)
+class Strategy:
+    """Инвестиционная стратегия"""
+    name: str
+    description: str
+    stocks: Tuple[str, ...]
+    allocation: str
+
+_STOCK_PROFILES: Mapping[str, StockProfile] = MappingProxyType({
+    'SBER': StockProfile(
+        name='Сбербанк',
+        sector='Финансы',
+        risk='Низкий',
+        potential='Умеренный',
+        dividend_yield='8-12%',
+        description='Крупнейший банк России, стабильные дивиденды, подходит для консервативных инвесторов'
+    ),
+    'GAZP': StockProfile(
+        name='Газпром',
+        sector='Энергетика',
+        risk='Средний',
+        potential='Умеренный',
+        dividend_yield='10-15%',
+        description='Газовая монополия, высокие дивиденды, волатильность зависит от цен на газ'
+    ),
+    'LKOH': StockProfile(
+        name='Лукойл',
+        sector='Нефть',
+        risk='Средний',
+        potential='Умеренный',
+        dividend_yield='7-10%',
+        description='Нефтяная компания, стабильные выплаты, зависит от цен на нефть'
+    ),
+    'ROSN': StockProfile(
+        name='Роснефть',
+        sector='Нефть',
+        risk='Средний',
+        potential='Умеренный',
+        dividend_yield='6-9%',
+        description='Государственная нефтяная компания, стратегический актив'
+    ),
+    'VTBR': StockProfile(
+        name='ВТБ',
+        sector='Финансы',
+        risk='Высокий',
+        potential='Высокий',
+        dividend_yield='5-8%',
+        description='Второй по величине банк, высокая волатильность, потенциал роста'
+    ),
+    'YNDX': StockProfile(
+        name='Яндекс',
+        sector='Технологии',
+        risk='Высокий',
+        potential='Высокий',
+        dividend_yield='0-2%',
+        description='Технологическая компания, высокий риск и потенциал роста'
+    ),
+    'TCSG': StockProfile(
+        name='Тинькофф',
+        sector='Финтех',
+        risk='Высокий',
+        potential='Высокий',
+        dividend_yield='3-5%',
+        description='Финтех компания, ориентирована на цифровые услуги, высокая волатильность'
+    )
+})
+
+_INVESTMENT_STRATEGIES: Mapping[str, Strategy] = MappingProxyType({
+    'conservative': Strategy(
+        name='Консервативная',
+        description='Сохранение капитала, низкий риск',
+        stocks=('SBER', 'GAZP'),
+        allocation='60-70% портфеля'
+    ),
+    'dividend': Strategy(
+        name='Дивидендная',
+        description='Регулярный доход, стабильные выплаты',
+        stocks=('GAZP', 'SBER', 'LKOH'),
+        allocation='40-60% портфеля'
+    ),
+    'growth': Strategy(
+        name='Роста',
+        description='Потенциал роста, высокий риск',
+        stocks=('YNDX', 'TCSG', 'VTBR'),
+        allocation='20-40% портфеля'
+    ),
+    'balanced': Strategy(
+        name='Сбалансированная',
+        description='Баланс роста и дохода',
+        stocks=('SBER', 'GAZP', 'YNDX'),
+        allocation='Равное распределение'
+    )
+})
+
 class StockAnalyzer:
     """Анализатор акций для генерации рекомендаций"""
     
     def __init__(self):
-        self.stock_profiles = {
-            'SBER': {
-                'name': 'Сбербанк',
-                'sector': 'Финансы',
-                'risk': 'Низкий',
-                'potential': 'Умеренный',
-                'dividend_yield': '8-12%',
-                'description': 'Крупнейший банк России, стабильные дивиденды, подходит для консервативных инвесторов'
-            },
-            'GAZP': {
-                'name': 'Газпром', 
-                'sector': 'Энергетика',
-                'risk': 'Средний',
-                'potential': 'Умеренный',
-                'dividend_yield': '10-15%',
-                'description': 'Газовая монополия, высокие дивиденды, волатильность зависит от цен на газ'
-            },
-            'LKOH': {
-                'name': 'Лукойл',
-                'sector': 'Нефть',
-                'risk': 'Средний',
-                'potential': 'Умеренный', 
-                'dividend_yield': '7-10%',
-                'description': 'Нефтяная компания, стабильные выплаты, зависит от цен на нефть'
-            },
-            'ROSN': {
-                'name': 'Роснефть',
-                'sector': 'Нефть',
-                'risk': 'Средний',
-                'potential': 'Умеренный',
-                'dividend_yield': '6-9%',
-                'description': 'Государственная нефтяная компания, стратегический актив'
-            },
-            'VTBR': {
-                'name': 'ВТБ',
-                'sector': 'Финансы',
-                'risk': 'Высокий',
-                'potential': 'Высокий',
-                'dividend_yield': '5-8%',
-                'description': 'Второй по величине банк, высокая волатильность, потенциал роста'
-            },
-            'YNDX': {
-                'name': 'Яндекс',
-                'sector': 'Технологии',
-                'risk': 'Высокий',
-                'potential': 'Высокий',
-                'dividend_yield': '0-2%',
-                'description': 'Технологическая компания, высокий риск и потенциал роста'
-            },
-            'TCSG': {
-                'name': 'Тинькофф',
-                'sector': 'Финтех',
-                'risk': 'Высокий', 
-                'potential': 'Высокий',
-                'dividend_yield': '3-5%',
-                'description': 'Финтех компания, ориентирована на цифровые услуги, высокая волатильность'
-            }
-        }
-        
-        self.investment_strategies = {
-            'conservative': {
-                'name': 'Консервативная',
-                'description': 'Сохранение капитала, низкий риск',
-                'stocks': ['SBER', 'GAZP'],
-                'allocation': '60-70% портфеля'
-            },
-            'dividend': {
-                'name': 'Дивидендная', 
-                'description': 'Регулярный доход, стабильные выплаты',
-                'stocks': ['GAZP', 'SBER', 'LKOH'],
-                'allocation': '40-60% портфеля'
-            },
-            'growth': {
-                'name': 'Роста',
-                'description': 'Потенциал роста, высокий риск',
-                'stocks': ['YNDX', 'TCSG', 'VTBR'],
-                'allocation': '20-40% портфеля'
-            },
-            'balanced': {
-                'name': 'Сбалансированная',
-                'description': 'Баланс роста и дохода',
-                'stocks': ['SBER', 'GAZP', 'YNDX'],
-                'allocation': 'Равное распределение'
-            }
-        }
+        self.stock_profiles = _STOCK_PROFILES
+        self.investment_strategies = _INVESTMENT_STRATEGIES
 
-    async def analyze_investment_query(self, question: str, market_data: Dict) -> Dict[str, Any]:
+    def analyze_investment_query(self, question: str, market_data: Dict) -> Dict[str, Any]:
         """Анализ инвестиционного запроса и генерация рекомендаций"""
         question_lower = question.lower()
         
-        # Определяем тип запроса
-        if any(word in question_lower for word in ['консерватив', 'сохран', 'надежн']):
-            strategy_type = 'conservative'
-        elif any(word in question_lower for word in ['дивидент', 'доход', 'выплат']):
-            strategy_type = 'dividend' 
-        elif any(word in question_lower for word in ['агрессив', 'рост', 'потенциал']):
-            strategy_type = 'growth'
-        elif any(word in question_lower for word in ['начать', 'начал', 'новычок']):
-            strategy_type = 'balanced'
-        else:
-            strategy_type = 'balanced'
+        # Определяем тип запроса: найденная стратегия с наивысшим приоритетом
+        strategy_type = min(
+            {m.lastgroup for m in _STRATEGY_RE.finditer(question_lower)},
+            key=_STRATEGY_PRIORITY.__getitem__, default='balanced'
+        )
         
-        return await self._generate_strategy_recommendation(strategy_type, market_data)
+        return self._generate_strategy(strategy_type, market_data)
 
-    async def analyze_single_stock(self, symbol: str, market_data: Dict) -> Dict[str, Any]:
+    def analyze_single_stock(self, symbol: str, market_data: Dict) -> Dict[str, Any]:
         """Анализ конкретной акции"""
         if symbol not in market_data:
             return {'error': f'Нет данных по акции {symbol}'}
         
         data = market_data[symbol]
-        profile = self.stock_profiles.get(symbol, {})
+        profile = self.stock_profiles.get(symbol) or StockProfile(name=symbol)
         
         # Анализ динамики
         change = data.get('change', 0)
@@ -142,45 +175,48 @@ class StockAnalyzer:
         
         return {
             'symbol': symbol,
-            'name': profile.get('name', symbol),
+            'name': profile.name,
             'current_price': data.get('last_price'),
             'change': change,
             'change_percent': change_percent,
             'trend': trend,
-            'sector': profile.get('sector'),
-            'risk': profile.get('risk'),
-            'potential': profile.get('potential'),
-            'dividend_yield': profile.get('dividend_yield'),
+            'sector': profile.sector,
+            'risk': profile.risk,
+            'potential': profile.potential,
+            'dividend_yield': profile.dividend_yield,
             'recommendation': recommendation,
             'sentiment': sentiment,
-            'description': profile.get('description')
+            'description': profile.description
         }
 
-    async def _generate_strategy(self, strategy_type: str, market_data: Dict) -> Dict[str, Any]:
+    def _generate_strategy(self, strategy_type: str, market_data: Dict) -> Dict[str, Any]:
         """Генерация рекомендаций по стратегии"""
         strategy = self.investment_strategies[strategy_type]
         stocks = []
         
-        for symbol in strategy['stocks']:
+        for symbol in strategy.stocks:
             if symbol in market_data:
                 data = market_data[symbol]
-                profile = self.stock_profiles.get(symbol, {})
+                profile = self.stock_profiles.get(symbol) or StockProfile(name=symbol, description='')
                 stocks.append({
                     'symbol': symbol, 
-                    'name': profile.get('name', symbol),
+                    'name': profile.name,
                     'price': data.get('last_price'), 
-                    'risk': profile.get('risk'),
-                    'dividend_yield': profile.get('dividend_yield'),
-                    'description': profile.get('description', '')
+                    'risk': profile.risk,
+                    'dividend_yield': profile.dividend_yield,
+                    'description': profile.description
                 })
         
         return {
-            'strategy_name': strategy['name'],
-            'strategy_description': strategy['description'],
-            'recommended_allocation': strategy['allocation'],
+            'strategy_name': strategy.name,
+            'strategy_description': strategy.description,
+            'recommended_allocation': strategy.allocation,
             'stocks': stocks
         }
 
     def get_available_strategies(self) -> Dict[str, Any]:
         """Получение информации о доступных стратегиях"""
-        return self.investment_strategies.copy()
\ No newline at end of file
+        return {
+            key: {**asdict(strategy), 'stocks': list(strategy.stocks)}
+            for key, strategy in self.investment_strategies.items()
+        }
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Интеграционные тесты DatabaseManager на настоящем PostgreSQL
+
+Запускаются, только если в AI_ASSISTANT_TEST_DSN задана строка подключения
+к отдельной тестовой базе: таблица users в ней пересоздается.
+"""
+import os
+from datetime import date
+
+import pytest
+
+asyncpg = pytest.importorskip('asyncpg')
+pytest_asyncio = pytest.importorskip('pytest_asyncio')
+
+from ai_assistant.registration.database import DatabaseManager
+
+DSN = os.getenv('AI_ASSISTANT_TEST_DSN')
+
+pytestmark = [
+    pytest.mark.skipif(not DSN, reason="AI_ASSISTANT_TEST_DSN не задан"),
+    pytest.mark.asyncio,
+]
+
+def make_user(n: int, **overrides):
+    user = {
+        'login': f'user_{n}',
+        'password': 'secret123',
+        'email': f'user{n}@example.com',
+        'full_name': 'Иванов Иван',
+        'passport_series': '1234',
+        'passport_number': f'{n:06d}',
+        'birth_date': date(1990, 1, 1),
+        'phone': f'7900{n:07d}',
+    }
+    user.update(overrides)
+    return user
+
+@pytest_asyncio.fixture
+async def db():
+    conn = await asyncpg.connect(DSN)
+    try:
+        await conn.execute('DROP TABLE IF EXISTS users')
+    finally:
+        await conn.close()
+
+    manager = DatabaseManager(DSN)
+    await manager.connect()
+    try:
+        yield manager
+    finally:
+        await manager.close()
+
+async def test_bulk_register_into_citext_columns(db):
+    result = await db.register_users_bulk([make_user(1), make_user(2)])
+    assert result['success'], result
+    assert sorted(result['registered']) == ['user_1', 'user_2']
+    assert result['rejected'] == {}
+
+async def test_bulk_register_skips_case_insensitive_duplicates(db):
+    assert (await db.register_users_bulk([make_user(1)]))['success']
+
+    result = await db.register_users_bulk([
+        make_user(2, login='USER_1'),
+        make_user(3, email='USER1@EXAMPLE.COM'),
+        make_user(4),
+    ])
+    assert result['success'], result
+    assert result['registered'] == ['user_4']
+    assert set(result['rejected']) == {'USER_1', 'user_3'}
+
+async def test_bulk_register_rejects_malformed_record(db):
+    malformed = make_user(1)
+    del malformed['phone']
+
+    result = await db.register_users_bulk([malformed, make_user(2)])
+    assert result['success'], result
+    assert result['registered'] == ['user_2']
+    assert 'user_1' in result['rejected']
+
+async def test_authenticate_ignores_login_case(db):
+    assert (await db.register_users_bulk([make_user(1)]))['success']
+
+    user = await db.authenticate_user('USER_1', 'secret123')
+    assert user is not None and user['login'] == 'user_1'
+    assert await db.authenticate_user('user_1', 'wrong-password') is None
+
+async def test_last_login_written_on_close(db):
+    assert (await db.register_users_bulk([make_user(1)]))['success']
+    user = await db.authenticate_user('user_1', 'secret123')
+    await db.close()
+
+    conn = await asyncpg.connect(DSN)
+    try:
+        last_login = await conn.fetchval('SELECT last_login FROM users WHERE id = $1', user['id'])
+    finally:
+        await conn.close()
+    assert last_login is not None
@@ -0,0 +1,70 @@
+"""Кольцевой буфер DialogueMemory совпадает с исходной реализацией на списке"""
+import itertools
+import random
+import time
+from typing import Any, Dict, List
+
+import pytest
+
+from ai_assistant.src.dialogue_memory import DialogueMemory
+
+class ReferenceMemory:
+    """Исходная реализация DialogueMemory"""
+
+    def __init__(self, max_messages: int = 10):
+        self.messages: List[Dict[str, Any]] = []
+        self.max_messages = max_messages
+
+    def add_message(self, role: str, content: str) -> None:
+        self.messages.append({'role': role, 'content': content, 'timestamp': time.time()})
+        if len(self.messages) > self.max_messages:
+            self.messages.pop(0)
+
+    def get_context(self, window_minutes: int = 30) -> List[Dict[str, Any]]:
+        cutoff = time.time() - (window_minutes * 60)
+        return [msg for msg in self.messages if msg['timestamp'] >= cutoff]
+
+    def clear(self) -> None:
+        self.messages.clear()
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое время: tick продвигает часы на заданное число секунд"""
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+
+    def tick(seconds: float) -> None:
+        now[0] += seconds
+    return tick
+
+@pytest.mark.parametrize("max_messages", [0, 1, 3, 10])
+def test_random_operations_match_reference(clock, max_messages):
+    rng = random.Random(max_messages)
+    memory, reference = DialogueMemory(max_messages), ReferenceMemory(max_messages)
+    counter = itertools.count()
+
+    for _ in range(300):
+        op = rng.random()
+        if op < 0.6:
+            role = rng.choice(['user', 'assistant'])
+            content = f"сообщение {next(counter)}"
+            memory.add_message(role, content)
+            reference.add_message(role, content)
+        elif op < 0.95:
+            window = rng.choice([0, 1, 5, 30])
+            assert memory.get_context(window) == reference.get_context(window)
+        else:
+            memory.clear()
+            reference.clear()
+        clock(rng.choice([0, 1, 30, 120, 600]))
+
+        assert memory.messages == reference.messages
+
+def test_window_boundary_is_inclusive(clock):
+    memory = DialogueMemory()
+    memory.add_message('user', 'старое')
+    clock(60)
+    memory.add_message('user', 'новое')
+    assert [m['content'] for m in memory.get_context(1)] == ['старое', 'новое']
+    clock(0.5)
+    assert [m['content'] for m in memory.get_context(1)] == ['новое']
@@ -0,0 +1,48 @@
+"""Персистентность EmbeddingCache и перенос кэша прежнего формата"""
+import hashlib
+import pickle
+
+import numpy as np
+
+from ai_assistant.src.cache_manager import EmbeddingCache
+
+class CountingEmbedder:
+    """Модель-заглушка: единичные векторы и счетчик закодированных текстов"""
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, texts, **kwargs):
+        self.encoded += len(texts)
+        return np.ones((len(texts), 3), dtype=np.float32)
+
+def test_roundtrip_through_mapped_files(tmp_path):
+    cache_file = str(tmp_path / 'embeddings_cache.pkl')
+    embedder = CountingEmbedder()
+    cache = EmbeddingCache(cache_file)
+    cache.get_embeddings(['a', 'b'], embedder)
+
+    reloaded = EmbeddingCache(cache_file)
+    assert len(reloaded) == 2
+    np.testing.assert_array_equal(reloaded.get_embeddings(['b', 'a'], embedder), np.ones((2, 3)))
+    assert embedder.encoded == 2
+
+def test_md5_pickle_is_migrated_on_lookup(tmp_path):
+    cache_file = tmp_path / 'embeddings_cache.pkl'
+    legacy = {
+        hashlib.md5(b'a').hexdigest(): np.array([[1, 2, 3]], dtype=np.float32),
+        hashlib.md5(b'b').hexdigest(): np.array([[4, 5, 6]], dtype=np.float32),
+    }
+    cache_file.write_bytes(pickle.dumps(legacy))
+
+    embedder = CountingEmbedder()
+    cache = EmbeddingCache(str(cache_file))
+    np.testing.assert_array_equal(cache.get_embedding('a', embedder), [[1, 2, 3]])
+    result = cache.get_embeddings(['b', 'c'], embedder)
+    np.testing.assert_array_equal(result, [[4, 5, 6], [1, 1, 1]])
+    assert embedder.encoded == 1
+
+    # Перенесенные векторы сохранены в новом формате
+    cache.flush()
+    reloaded = EmbeddingCache(str(cache_file))
+    np.testing.assert_array_equal(reloaded.get_embeddings(['a', 'b'], embedder), [[1, 2, 3], [4, 5, 6]])
+    assert embedder.encoded == 1
@@ -0,0 +1,28 @@
+"""FinancialAssistant._format_number совпадает с исходной цепочкой сравнений"""
+import math
+
+import pytest
+
+from ai_assistant.src.financial_assistant import FinancialAssistant
+
+def reference_format(number: float) -> str:
+    if number >= 1_000_000_000:
+        return f"{number/1_000_000_000:.1f} млрд"
+    elif number >= 1_000_000:
+        return f"{number/1_000_000:.1f} млн"
+    elif number >= 1_000:
+        return f"{number/1_000:.1f} тыс"
+    return str(number)
+
+@pytest.fixture
+def assistant():
+    # Конструктор подключает модели и сервисы, метод от них не зависит
+    return object.__new__(FinancialAssistant)
+
+@pytest.mark.parametrize("number", [
+    0, 1, 999, 999.99, 1_000, 1_000.0, 1_500, 999_999, 1_000_000, 2.5e6,
+    999_999_999, 1_000_000_000, 7.3e12, -5, -1_000_000, 0.5,
+    math.inf, -math.inf, math.nan,
+])
+def test_matches_reference(assistant, number):
+    assert assistant._format_number(number) == reference_format(number)
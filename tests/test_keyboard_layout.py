@@ -0,0 +1,44 @@
+"""Исправление раскладки совпадает с исходной посимвольной проверкой"""
+import pytest
+
+from ai_assistant.src.ai_assistant import SmartDeepThinkRAG
+
+EN_CHARS = "qwertyuiop[]asdfghjkl;'zxcvbnm,./`"
+RU_CHARS = "йцукенгшщзхъфывапролджэячсмитьбю.ё"
+
+def reference_fix(text: str) -> str:
+    """Исходная реализация _fix_keyboard_layout"""
+    if not text:
+        return text
+    en_all = EN_CHARS + EN_CHARS.upper()
+    char_map = str.maketrans(en_all, RU_CHARS + RU_CHARS.upper())
+    latin_count = sum(1 for c in text if c in en_all)
+    if latin_count / len(text) > 0.3:
+        return text.translate(char_map)
+    return text
+
+@pytest.fixture
+def assistant():
+    # Конструктор загружает модели и сервисы, метод от них не зависит
+    return object.__new__(SmartDeepThinkRAG)
+
+@pytest.mark.parametrize("text", [
+    "",
+    "ghbdtn rfr ltkf",
+    "привет как дела",
+    "курс usd",
+    "акции SBER и GAZP",
+    "Ghbdtn, vbh!",
+    "ghbdtn 😀😀😀😀",
+    "ghbdtn €€€€€€",
+    "😀😀😀😀😀😀 ab",
+    "цена 100 €",
+    "x",
+    "ё",
+])
+def test_matches_reference(assistant, text):
+    assert assistant._fix_keyboard_layout(text) == reference_fix(text)
+
+def test_multibyte_tail_still_converted(assistant):
+    assert assistant._fix_keyboard_layout("ghbdtn 😀😀😀😀") == "привет 😀😀😀😀"
+    assert assistant._fix_keyboard_layout("ghbdtn €€€€€€") == "привет €€€€€€"
@@ -0,0 +1,53 @@
+"""KnowledgeBase совпадает с построчным чтением файла в текстовом режиме"""
+import random
+
+import pytest
+
+from ai_assistant.src.knowledge_base import KnowledgeBase
+
+def reference_documents(path):
+    """Исходная загрузка базы знаний"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def load(tmp_path, content: str):
+    path = tmp_path / 'kb.txt'
+    path.write_bytes(content.encode('utf-8'))
+    kb = KnowledgeBase(str(path))
+    return kb, reference_documents(path)
+
+@pytest.mark.parametrize("content", [
+    "",
+    "\n",
+    "один\nдва\n",
+    "один\r\nдва\r\n\r\nтри",
+    "один\rдва\r\rтри\r",
+    "  пробелы  \n\t\n  \n",
+    " \nнеразрывный пробел \n",
+    "　  \n\u0085\n\x1c\x1f\nтекст",
+    "без перевода строки в конце",
+    "смешанный\r\n\rконец\n\r",
+])
+def test_matches_text_mode_reading(tmp_path, content):
+    kb, expected = load(tmp_path, content)
+    assert list(kb) == expected
+    assert kb.take(range(len(kb))) == expected
+    kb.close()
+
+def test_random_whitespace_mix(tmp_path):
+    alphabet = ['а', 'b', ' ', '\t', '\n', '\r', '\r\n', ' ', ' ', '　',
+                '\x0b', '\x1d', '€', '😀', '​']
+    rng = random.Random(0)
+    for _ in range(200):
+        content = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        kb, expected = load(tmp_path, content)
+        assert list(kb) == expected, repr(content)
+        kb.close()
+
+def test_negative_index_and_slice(tmp_path):
+    kb, expected = load(tmp_path, "a\nb\nc\n")
+    assert kb[-1] == expected[-1]
+    assert kb[1:] == expected[1:]
+    with pytest.raises(IndexError):
+        kb[3]
+    kb.close()
@@ -0,0 +1,41 @@
+"""Метрики ассистента: локальная статистика и текстовый формат Prometheus"""
+import pytest
+
+prometheus_client = pytest.importorskip('prometheus_client')
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from ai_assistant.src.metrics_collector import MetricsCollector
+
+@pytest.fixture(scope='module')
+def collector():
+    # Метрики регистрируются в глобальном реестре, второй экземпляр невозможен
+    return MetricsCollector()
+
+def test_fast_text_matches_generate_latest(collector):
+    collector.log_query('вопрос', 'definition', 0.2)
+    collector.log_query('вопрос', 'process', 3.5, success=False, cache_hit=True)
+
+    registry = CollectorRegistry()
+    registry.register(collector.request_counter)
+    registry.register(collector.response_time)
+
+    collector.fast_metrics_text = True
+    try:
+        assert collector.get_metrics_text() == generate_latest(registry)
+    finally:
+        collector.fast_metrics_text = False
+
+def test_local_metrics(collector):
+    before = collector.get_metrics()
+    collector.log_query('вопрос', 'definition', 1.0, cache_hit=False)
+    after = collector.get_metrics()
+
+    assert after['total_queries'] == before['total_queries'] + 1
+    assert after['successful_responses'] == before['successful_responses'] + 1
+    assert after['intent_distribution']['definition'] == \
+        before['intent_distribution'].get('definition', 0) + 1
+
+    # Возвращается копия, а не внутреннее состояние
+    after['intent_distribution']['definition'] = -1
+    assert collector.get_metrics()['intent_distribution']['definition'] != -1
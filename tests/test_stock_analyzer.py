@@ -0,0 +1,77 @@
+"""StockAnalyzer совпадает с исходной реализацией на словарях"""
+import pytest
+
+from ai_assistant.src.stock_analyzer import StockAnalyzer
+
+BASELINE_STRATEGIES = {
+    'conservative': {
+        'name': 'Консервативная',
+        'description': 'Сохранение капитала, низкий риск',
+        'stocks': ['SBER', 'GAZP'],
+        'allocation': '60-70% портфеля'
+    },
+    'dividend': {
+        'name': 'Дивидендная',
+        'description': 'Регулярный доход, стабильные выплаты',
+        'stocks': ['GAZP', 'SBER', 'LKOH'],
+        'allocation': '40-60% портфеля'
+    },
+    'growth': {
+        'name': 'Роста',
+        'description': 'Потенциал роста, высокий риск',
+        'stocks': ['YNDX', 'TCSG', 'VTBR'],
+        'allocation': '20-40% портфеля'
+    },
+    'balanced': {
+        'name': 'Сбалансированная',
+        'description': 'Баланс роста и дохода',
+        'stocks': ['SBER', 'GAZP', 'YNDX'],
+        'allocation': 'Равное распределение'
+    }
+}
+
+def reference_strategy(question: str) -> str:
+    """Исходная цепочка any(...) с исправленными опечатками в ключевых словах"""
+    q = question.lower()
+    if any(word in q for word in ['консерватив', 'сохран', 'надежн']):
+        return 'conservative'
+    if any(word in q for word in ['дивиденд', 'доход', 'выплат']):
+        return 'dividend'
+    if any(word in q for word in ['агрессив', 'рост', 'потенциал']):
+        return 'growth'
+    return 'balanced'
+
+MARKET = {symbol: {'last_price': 100.0, 'change': 1.0} for symbol in
+          ('SBER', 'GAZP', 'LKOH', 'ROSN', 'VTBR', 'YNDX', 'TCSG')}
+
+@pytest.fixture
+def analyzer():
+    return StockAnalyzer()
+
+@pytest.mark.parametrize("question", [
+    "Куда вложить деньги?",
+    "Хочу надежно сохранить капитал",
+    "Какие акции платят дивиденды?",
+    "Нужен доход и потенциал роста",
+    "Агрессивная стратегия",
+    "Я новичок, как начать?",
+    "Рост и дивиденды и надежность",
+    "КОНСЕРВАТИВНЫЙ портфель",
+])
+def test_strategy_routing(analyzer, question):
+    expected = BASELINE_STRATEGIES[reference_strategy(question)]
+    result = analyzer.analyze_investment_query(question, MARKET)
+    assert result['strategy_name'] == expected['name']
+    assert [s['symbol'] for s in result['stocks']] == expected['stocks']
+
+def test_available_strategies_are_plain_dicts(analyzer):
+    assert analyzer.get_available_strategies() == BASELINE_STRATEGIES
+
+def test_single_stock_unknown_symbol(analyzer):
+    result = analyzer.analyze_single_stock('XXXX', {'XXXX': {'change': -1}})
+    assert result['name'] == 'XXXX'
+    assert result['sector'] is None and result['description'] is None
+    assert result['trend'] == 'нисходящий'
+
+def test_single_stock_missing_data(analyzer):
+    assert 'error' in analyzer.analyze_single_stock('SBER', {})